@@ -0,0 +1,130 @@
+"""
+Benchmark of the tweet preprocessing
+
+Compares the original per-tweet cleaning (patterns compiled inside the
+function) with preprocess.clean_tweets_batch, and checks that the outputs are
+identical. Tweets are read from ndjson files or generated synthetically.
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import time
+from glob import glob
+
+import preprocess
+
+
+def clean_tweets_reference(tweet):
+    """
+    The original implementation of preprocess.clean_tweets, used as reference
+    """
+    clean_tweet = re.sub(r"@(\S*)\w", "", tweet)  # mentions
+    clean_tweet = re.sub(r"#\S*\w", "", clean_tweet)  # hashtags
+    url_pattern = re.compile(preprocess.URL_PATTERN.pattern)
+    clean_tweet = re.sub(url_pattern, "", clean_tweet)
+    emoji_pattern = re.compile(preprocess.EMOJI_PATTERN.pattern, flags=re.UNICODE)
+    return emoji_pattern.sub(r"", clean_tweet)
+
+
+def synthetic_tweets(n: int, seed: int = 1):
+    """
+    returns n tweets mixing words, mentions, hashtags, urls, emojis and retweets
+    """
+    rng = random.Random(seed)
+    parts = [
+        "godmorgen",
+        "det",
+        "er",
+        "en",
+        "god",
+        "dag",
+        "corona",
+        "vaccine",
+        "@dr_nyheder",
+        "#dkpol",
+        "#covid19dk",
+        "https://t.co/abc123XYZ",
+        "www.dr.dk/nyheder",
+        "\U0001F600",
+        "❤️",
+        "æøå",
+        "a#@b",
+    ]
+    tweets = []
+    for _ in range(n):
+        tweet = " ".join(rng.choice(parts) for _ in range(rng.randint(1, 25)))
+        if rng.random() < 0.2:
+            tweet = "RT " + tweet
+        tweets.append(tweet)
+    return tweets
+
+
+def read_tweets(filepath: str, n: int):
+    def gen():
+        for in_file in sorted(glob(filepath)):
+            with open(in_file) as f:
+                for line in f:
+                    if line.strip():
+                        post = json.loads(line)
+                        if post:
+                            yield post["text"]
+
+    return list(itertools.islice(gen(), n))
+
+
+def main(tweets: list, n_workers: int):
+    start_time = time.time()
+    reference = [
+        None if re.search("^RT", tweet) else clean_tweets_reference(tweet)
+        for tweet in tweets
+    ]
+    reference_time = time.time() - start_time
+    print(f"reference: {reference_time:.2f} s ({len(tweets)/reference_time:.0f} tweets/s)")
+
+    start_time = time.time()
+    cleaned, is_retweet, is_empty = preprocess.clean_tweets_batch(
+        tweets, n_workers=n_workers
+    )
+    batch_time = time.time() - start_time
+    print(
+        f"clean_tweets_batch (n_workers={n_workers}): {batch_time:.2f} s ({len(tweets)/batch_time:.0f} tweets/s)"
+    )
+    print(f"speedup: {reference_time/batch_time:.1f}x")
+    print(f"retweets: {sum(is_retweet)}, empty after cleaning: {sum(is_empty)}")
+
+    assert cleaned == reference, "output differs from the original implementation"
+    print("output is identical to the original implementation")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--in_filepath",
+        type=str,
+        required=False,
+        default=None,
+        help="Filepath for ndjson input files. If not defined, synthetic tweets are used.",
+    )
+    parser.add_argument(
+        "--n_tweets",
+        type=int,
+        required=False,
+        default=1000000,
+        help="Number of tweets. Default is 1000000.",
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of processes for clean_tweets_batch. Default is 1.",
+    )
+    args = parser.parse_args()
+
+    if args.in_filepath:
+        tweets = read_tweets(args.in_filepath + "*.ndjson", args.n_tweets)
+    else:
+        tweets = synthetic_tweets(args.n_tweets)
+    main(tweets, args.n_workers)
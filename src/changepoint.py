@@ -4,9 +4,10 @@ Detecting change points in information signal using ruptures
 import numpy as np
 import ruptures as rpt
 import pandas as pd
-import re, os
+import os
 from typing import List, Optional
 import argparse
+from prob_columns import read_prob_matrix
 
 
 def detect_change_points(ts: np.ndarray, pen: int):
@@ -25,15 +26,6 @@ def detect_change_points(ts: np.ndarray, pen: int):
     return change_locations
 
 
-def get_emotion_distribution(emo: str):
-    """
-    For transforming the emotion distribution from a str to a list of floats
-    """
-    emo_list = re.sub("[^A-Za-z0-9\s.]+", "", emo).split(" ")
-    emo_list = list(map(lambda x: float(x), emo_list))
-    return emo_list
-
-
 def emotions_dict(df: pd.DataFrame, emotion_col: str, labels: List[str]):
     """
     gives dict with list of probabilities for the different emotions in labels from pd.DataFrame
@@ -46,9 +38,8 @@ def emotions_dict(df: pd.DataFrame, emotion_col: str, labels: List[str]):
     Returns
         dict: with labels as keys and probabilities as values
     """
-    emo_lists = list(map(get_emotion_distribution, list(df[emotion_col])))
-    zip_emo_lists = [probs for probs in zip(*emo_lists)]
-    return {label: probs for label, probs in zip(labels, zip_emo_lists)}
+    probs = read_prob_matrix(df, emotion_col)
+    return {label: probs[:, i] for i, label in enumerate(labels)}
 
 
 def write_model_df(
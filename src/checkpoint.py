@@ -0,0 +1,74 @@
+"""
+Checkpoints for resuming long classification runs
+
+A checkpoint records how far the input has been committed to the output:
+the input file and byte offset after the last written tweet, the index of the
+next output row and the size of the output file at that point.
+"""
+import json
+import os
+from typing import Optional
+
+
+class Checkpoint:
+    """
+    Checkpoint stored as json next to the output file
+
+    Args:
+        filepath (str): path of the checkpoint file
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+
+    def load(self) -> Optional[dict]:
+        """
+        returns the saved state or None if there is no checkpoint
+        """
+        if not os.path.exists(self.filepath):
+            return None
+        with open(self.filepath) as f:
+            return json.load(f)
+
+    def save(self, state: dict):
+        """
+        Writes the state atomically, so a crash never leaves a broken checkpoint
+        """
+        tmp_path = f"{self.filepath}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.filepath)
+
+    def commit(
+        self, position: tuple, index: int, out_filepath: str, finished: bool = False
+    ):
+        """
+        Saves a checkpoint after the output file has been flushed
+
+        Args:
+            position (tuple): (input file, byte offset) after the last written tweet
+            index (int): index of the next output row
+            out_filepath (str): path of the output file
+            finished (bool): whether all input has been processed
+        """
+        in_file, offset = position
+        self.save(
+            {
+                "in_file": in_file,
+                "offset": offset,
+                "index": index,
+                "out_size": os.path.getsize(out_filepath),
+                "finished": finished,
+            }
+        )
+
+
+def restore_output(state: dict, out_filepath: str):
+    """
+    Truncates the output file to its size at the checkpoint, removing rows
+    written after the last checkpoint (they are recomputed on resume)
+    """
+    with open(out_filepath, "r+b") as f:
+        f.truncate(state["out_size"])
@@ -0,0 +1,76 @@
+"""
+Persistent cache of classifier outputs
+
+After cleaning, many tweets are identical (bot posts, copy-pasta, greetings).
+The outputs of the models are stored in a SQLite database keyed by a hash of
+the model version and the cleaned text, so repeated texts skip the models,
+also across reruns and when the corpus is extended.
+"""
+import hashlib
+import pickle
+import sqlite3
+from typing import Dict, List
+
+
+class ClassifierCache:
+    """
+    Cache of model outputs stored in SQLite
+
+    Args:
+        filepath (str): path of the SQLite database
+        model_version (str): identifies the models, outputs of other versions are not used
+    """
+
+    def __init__(self, filepath: str, model_version: str):
+        self.filepath = filepath
+        self.model_version = model_version
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(filepath, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outputs (key BLOB PRIMARY KEY, value BLOB)"
+        )
+        self.conn.commit()
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha1(f"{self.model_version}\0{text}".encode()).digest()
+
+    def get_many(self, texts: List[str]) -> Dict[int, object]:
+        """
+        Looks up the texts
+
+        returns
+            dict: with the index in texts and the cached outputs of the texts found
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}
+        for i in range(0, len(keys), 500):  # sqlite limits the number of parameters
+            chunk = keys[i : i + 500]
+            query = f"SELECT key, value FROM outputs WHERE key IN ({','.join('?' * len(chunk))})"
+            found.update(self.conn.execute(query, chunk).fetchall())
+        outputs = {i: pickle.loads(found[key]) for i, key in enumerate(keys) if key in found}
+        self.hits += len(outputs)
+        self.misses += len(texts) - len(outputs)
+        return outputs
+
+    def put_many(self, texts: List[str], outputs: list):
+        """
+        Stores the outputs of the texts
+        """
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO outputs VALUES (?, ?)",
+            [(self.key(text), pickle.dumps(out)) for text, out in zip(texts, outputs)],
+        )
+        self.conn.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self.conn.close()
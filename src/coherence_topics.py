@@ -1,8 +1,7 @@
 """
 Estimation the optimal number of topics for the topic modelling using gensims coherence model
 """
-from glob import glob
-import ndjson, re, random
+import re, random
 import numpy as np
 import pandas as pd
 from tweetopic import DMM, TopicPipeline
@@ -11,23 +10,11 @@ from tmtoolkit.topicmod.evaluate import metric_coherence_gensim
 import matplotlib.pyplot as plt
 import time
 import functools, multiprocessing
-
-
-def ndjson_gen(filepath: str, text_field: str = "text"):
-    for in_file in glob(filepath):
-        with open(in_file) as f:
-            reader = ndjson.reader(f)
-
-            for post in reader:
-                if not post:  # remove empty posts
-                    continue
-                if re.search("^RT", post[text_field]):  # remove retweets
-                    continue
-                yield post
+from ndjson_reader import ndjson_gen
 
 
 def text_gen(filepath: str, text_field: str = "text"):
-    for post in ndjson_gen(filepath):
+    for post in ndjson_gen(filepath, [text_field], text_field):
         yield post[text_field]
 
 
@@ -0,0 +1,115 @@
+"""
+Helpers for running the classification models on CPU
+
+- dynamic int8 quantization of the transformer models in a spacy pipeline
+- fingerprint of the weights of the models in a spacy pipeline
+- comparison of the outputs of two pipelines (e.g. fp32 and int8)
+"""
+import hashlib
+from typing import List
+
+import numpy as np
+
+
+def quantize_pipeline(nlp) -> int:
+    """
+    Applies dynamic int8 quantization to the linear layers of all PyTorch models
+    wrapped in the components of the spacy pipeline (the DaNLP BERT models and
+    the huggingface classification transformers).
+
+    returns
+        int: number of quantized models
+    """
+    import torch
+    from thinc.api import PyTorchShim
+
+    n_quantized = 0
+    for _, pipe in nlp.pipeline:
+        model = getattr(pipe, "model", None)
+        if model is None:
+            continue
+        for node in model.walk():
+            for shim in node.shims:
+                if isinstance(shim, PyTorchShim):
+                    shim._model = torch.quantization.quantize_dynamic(
+                        shim._model, {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                    n_quantized += 1
+    return n_quantized
+
+
+def _hash_state(sha, name: str, value):
+    """
+    Adds a state dict entry (tensor, or tuple of tensors for quantized layers)
+    to the hash. Quantized tensors are hashed as their integer values and
+    their scales and zero points.
+    """
+    import torch
+
+    if isinstance(value, (tuple, list)):
+        for i, item in enumerate(value):
+            _hash_state(sha, f"{name}.{i}", item)
+    elif isinstance(value, torch.Tensor):
+        if value.is_quantized:
+            if value.qscheme() in (torch.per_tensor_affine, torch.per_tensor_symmetric):
+                sha.update(f"{name}:{value.q_scale()}:{value.q_zero_point()}".encode())
+            else:
+                _hash_state(sha, f"{name}.scales", value.q_per_channel_scales())
+                _hash_state(sha, f"{name}.zero_points", value.q_per_channel_zero_points())
+                sha.update(f"{name}:{value.q_per_channel_axis()}".encode())
+            value = value.int_repr()
+        tensor = value.detach().cpu().contiguous()
+        sha.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+        sha.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    else:  # e.g. the dtype of quantized layers
+        sha.update(f"{name}:{value!r}".encode())
+
+
+def weights_fingerprint(nlp) -> str:
+    """
+    returns sha1 of the weights of all PyTorch models wrapped in the components
+    of the spacy pipeline, so a new version of a model gets a new fingerprint
+    """
+    from thinc.api import PyTorchShim
+
+    sha = hashlib.sha1()
+    for pipe_name, pipe in nlp.pipeline:
+        model = getattr(pipe, "model", None)
+        if model is None:
+            continue
+        for node in model.walk():
+            for shim in node.shims:
+                if isinstance(shim, PyTorchShim):
+                    for name, value in shim._model.state_dict().items():
+                        _hash_state(sha, f"{pipe_name}.{name}", value)
+    return sha.hexdigest()
+
+
+def compare_outputs(rows_a: List[list], rows_b: List[list], columns: List[str]) -> dict:
+    """
+    Compares two lists of output rows of the same tweets column by column.
+    Labels are compared by agreement rate, probabilities by absolute difference.
+
+    Args:
+        rows_a (List[list]): output rows of the reference pipeline
+        rows_b (List[list]): output rows of the pipeline to check
+        columns (List[str]): names of the columns to compare
+
+    returns
+        dict: with the comparison for each column
+    """
+    report = {}
+    for i, col in enumerate(columns):
+        if not col or col in ["created_at", "id"]:
+            continue
+        a = [row[i] for row in rows_a]
+        b = [row[i] for row in rows_b]
+        if isinstance(a[0], str):
+            report[col] = {"agreement": float(np.mean([x == y for x, y in zip(a, b)]))}
+        else:
+            diff = np.abs(np.asarray(a, dtype=float) - np.asarray(b, dtype=float))
+            report[col] = {
+                "max_abs_diff": float(diff.max()),
+                "mean_abs_diff": float(diff.mean()),
+            }
+    return report
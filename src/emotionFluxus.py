@@ -10,14 +10,39 @@ import argparse
 from typing import List
 
 import ndjson, datetime
+import numpy as np
 import pandas as pd
 
-import os, sys
+import functools
+import multiprocessing
+import os
+import time as timer
 
-path = os.path.join("newsFluxus", "src")
-sys.path.append(path)
+from infodynamics import (
+    DIVERGENCES,
+    extract_novelty_resonance,
+    get_divergence,
+    kld,
+    leave_one_out,
+    novelty_transience_resonance,
+    resample_distributions,
+    sweep_windows,
+)
 
-from main_extractor import extract_novelty_resonance
+EMO_LABELS = [
+    "Glæde/Sindsro",
+    "Tillid/Accept",
+    "Forventning/Interrese",
+    "Overasket/Målløs",
+    "Vrede/Irritation",
+    "Foragt/Modvilje",
+    "Sorg/trist",
+    "Frygt/Bekymret",
+]
+POL_LABELS = ["positve", "neutral", "negative"]
+
+# loaded series of the worker processes, set by init_worker
+_worker = {}
 
 
 def get_emo(d: dict) -> list:
@@ -32,13 +57,15 @@ def get_time(d: dict) -> datetime.datetime:
     returns time as type datetime.datetime
     """
     group = d["group"]
+    if isinstance(group, int):  # start of a time bin in seconds since 1970 (local clock)
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=group)
     if isinstance(group, list):  # when both date and time is included
         date, hour = group
         date = list(map(int, date.split("-")))
         hour = int(hour)
         return datetime.datetime(*date, hour)
-    time = list(map(int, group.split("-")))
-    return datetime.datetime(*time)
+    time = list(map(int, group.split("-")))  # year, month and day, or a prefix
+    return datetime.datetime(*time, *[1] * (3 - len(time)))
 
 
 def get_data_time(d: dict) -> list:
@@ -53,14 +80,25 @@ def get_data_time(d: dict) -> list:
     return data, time
 
 
-def exclude_emotion_from_distribution(emo_distribution: List[int], index: int):
+def check_labels(labels: List[str], data: list, filename: str):
     """
-    Removes the emotion according to the index.
-    Returns list with all the other emotions, with same relative size.
-    Sum of the returned list is still 1
+    Raises ValueError if there is not a label for each emotion of the distributions
     """
-    exclude_emo = emo_distribution[:index] + emo_distribution[index + 1 :]
-    return [emo / sum(exclude_emo) for emo in exclude_emo]
+    n_classes = len(data[0]) if len(data) else 0
+    if len(labels) != n_classes:
+        raise ValueError(
+            f"{filename} has distributions over {n_classes} emotions, but {len(labels)} labels are given ({labels})"
+        )
+
+
+def signals_frame(time: list, signals: dict, **columns) -> pd.DataFrame:
+    """
+    returns dataframe with the date, the columns and the signals
+    """
+    df = pd.DataFrame({"date": time, **columns})
+    for name, signal in signals.items():
+        df[name] = signal
+    return df
 
 
 def extract_excluded_emos(
@@ -68,39 +106,34 @@ def extract_excluded_emos(
     out_folder: str,
     out_name: str,
     window: int,
-    labels: List[str] = [
-        "Glæde/Sindsro",
-        "Tillid/Accept",
-        "Forventning/Interrese",
-        "Overasket/Målløs",
-        "Vrede/Irritation",
-        "Foragt/Modvilje",
-        "Sorg/trist",
-        "Frygt/Bekymret",
-    ],
+    labels: List[str] = EMO_LABELS,
+    divergence=kld,
 ):
     """
     Extracts novelty, transience and resonance excluding each emotion one at a time
-    Writes to csv
+    Writes to one csv with a column excluded with the label of the left out emotion
     """
     with open(filename) as f:
         emo_file = ndjson.load(f)
 
     data, time = get_data_time(emo_file)
+    check_labels(labels, data, filename)
 
-    # Leave one emotion out at a time and extract novelty and resonance
-    for i, label in enumerate(labels):
-        df = pd.DataFrame()
-        df["date"] = time
-        # df[f'no_{label}'] = [d[:i] + d[i+1:] for d in data]
-        df[f"no_{label}"] = [exclude_emotion_from_distribution(d, i) for d in data]
-        out_path = os.path.join(out_folder, f"{out_name}_W{window}_no_{label[:4]}.csv")
-        df = extract_novelty_resonance(df, df[f"no_{label}"], time, window)
-        df.to_csv(out_path, index=False)
-        print(f"Saved file excluding {label}")
+    # Leave one emotion out at a time (renormalizing the others) and extract
+    # novelty and resonance for all of them at once
+    signals = novelty_transience_resonance(leave_one_out(data), window, divergence)
+    dfs = [
+        signals_frame(
+            time, {name: signal[i] for name, signal in signals.items()}, excluded=label
+        )
+        for i, label in enumerate(labels)
+    ]
+    out_path = os.path.join(out_folder, f"{out_name}_W{window}_excluded.csv")
+    pd.concat(dfs, ignore_index=True).to_csv(out_path, index=False)
+    print(f"Saved file excluding each of {labels}")
 
 
-def main_extract(filename: str, out_path: str, window: int):
+def main_extract(filename: str, out_path: str, window: int, divergence=kld):
     """
     Extracts novelty, transience and resonance
     Writes to csv
@@ -113,26 +146,288 @@ def main_extract(filename: str, out_path: str, window: int):
     df = pd.DataFrame()
     df["date"] = time
     df["emo_prob"] = data
-    df = extract_novelty_resonance(df, data, time, window)
+    df = extract_novelty_resonance(df, data, time, window, divergence)
+    df.to_csv(out_path, index=False)
+
+
+def main_sweep(filename: str, out_path: str, windows: List[int], divergence=kld):
+    """
+    Extracts novelty, transience and resonance for each window size in windows
+    Writes to one csv with a window column
+    """
+    with open(filename) as f:
+        emo_file = ndjson.load(f)
+
+    data, time = get_data_time(emo_file)
+
+    dfs = [
+        signals_frame(time, signals, window=window)
+        for window, signals in sweep_windows(data, windows, divergence).items()
+    ]
+    pd.concat(dfs, ignore_index=True).to_csv(out_path, index=False)
+
+
+def init_worker(series: dict, divergence):
+    """
+    Sets the loaded series (file: distributions) shared by the tasks of the
+    worker, and the divergence
+    """
+    _worker["series"] = series
+    _worker["divergence"] = divergence
+
+
+def signals_task(task: tuple) -> tuple:
+    """
+    Extracts the signals of one series: the file, the file without one
+    emotion or a sweep over window sizes
+
+    Args:
+        task (tuple): file, index of the excluded emotion (None for all emotions), window, windows
+
+    returns
+        task, signals (window: signals), time in seconds
+    """
+    file, excluded, window, windows = task
+    start_time = timer.time()
+    data, divergence = _worker["series"][file], _worker["divergence"]
+    if excluded is not None:
+        data = leave_one_out(data, [excluded])[0]
+    if windows:
+        signals = sweep_windows(data, windows, divergence)
+    else:
+        signals = {window: novelty_transience_resonance(data, window, divergence)}
+    return task, signals, timer.time() - start_time
+
+
+def main_parallel(
+    filenames: List[str],
+    window: int,
+    labels: List[str],
+    windows: List[int],
+    n_workers: int,
+    divergence=kld,
+    suffix: str = "",
+):
+    """
+    Extracts the signals of all files, and of each file without each of
+    the labels, as independent tasks in n_workers processes. The files are
+    loaded once and shared with the workers. Writes the same files as the
+    serial extraction (with suffix added to the file names).
+    """
+    start_time = timer.time()
+    loaded = {}
+    for file in filenames:
+        filename = os.path.join("summarized_emo", f"{file}.ndjson")
+        with open(filename) as f:
+            loaded[file] = get_data_time(ndjson.load(f))
+        if labels:
+            check_labels(labels, loaded[file][0], filename)
+    series = {
+        file: np.array(data, dtype=np.float64) for file, (data, _) in loaded.items()
+    }
+
+    tasks = []
+    for file in filenames:
+        tasks.append((file, None, window, windows))
+        tasks.extend((file, i, window, None) for i in range(len(labels)))
+
+    results = {}
+    with multiprocessing.Pool(
+        n_workers, initializer=init_worker, initargs=(series, divergence)
+    ) as pool:
+        for task, signals, task_time in pool.imap_unordered(signals_task, tasks):
+            results[task[:2]] = signals
+            file, excluded = task[:2]
+            name = file if excluded is None else f"{file} excluding {labels[excluded]}"
+            print(f"Finished {name} - time in s: {task_time:.3f}")
+
+    for file in filenames:
+        data, time = loaded[file]
+        signals = results[file, None]
+        if windows:
+            df = pd.concat(
+                [signals_frame(time, signals[w], window=w) for w in signals],
+                ignore_index=True,
+            )
+            df.to_csv(os.path.join("idmdl", f"{file}{suffix}_sweep.csv"), index=False)
+        else:
+            df = signals_frame(time, signals[window], emo_prob=data)
+            out_path = os.path.join("idmdl", f"{file}{suffix}_W{window}.csv")
+            df.to_csv(out_path, index=False)
+        if labels:
+            df = pd.concat(
+                [
+                    signals_frame(time, results[file, i][window], excluded=label)
+                    for i, label in enumerate(labels)
+                ],
+                ignore_index=True,
+            )
+            out_path = os.path.join("idmdl", f"{file}{suffix}_W{window}_excluded.csv")
+            df.to_csv(out_path, index=False)
+    print(
+        f"Finished {len(tasks)} tasks in {n_workers} processes - time in s: {timer.time() - start_time:.3f}"
+    )
+
+
+def get_moments(emo_file: list) -> tuple:
+    """
+    returns the mean distributions, their standard deviations and numbers of
+    tweets as arrays of shape (T, K), (T, K) and (T,)
+    """
+    if any("n" not in d or "emo_prob_sd" not in d for d in emo_file):
+        raise ValueError(
+            "Bootstrapping needs the n and emo_prob_sd of each group, summarize the tweets again with summarize_models.py"
+        )
+    mean = np.array([d["emo_prob"] for d in emo_file], dtype=np.float64)
+    sd = np.array([d["emo_prob_sd"] for d in emo_file], dtype=np.float64)
+    n = np.array([d["n"] for d in emo_file], dtype=np.float64)
+    return mean, sd, n
+
+
+def bootstrap_chunk(
+    chunk: tuple,
+    mean: np.ndarray,
+    sd: np.ndarray,
+    n: np.ndarray,
+    window: int,
+    divergence,
+) -> dict:
+    """
+    Computes novelty, transience and resonance of a chunk of replicates
+
+    Args:
+        chunk (tuple): seed (np.random.SeedSequence) and number of replicates
+
+    returns
+        dict: novelty, transience, resonance as arrays of shape (replicates, T)
+    """
+    seed, n_replicates = chunk
+    replicates = resample_distributions(
+        mean, sd, n, n_replicates, np.random.default_rng(seed)
+    )
+    signals = novelty_transience_resonance(replicates, window, divergence)
+    return {name: signals[name] for name in ["novelty", "transience", "resonance"]}
+
+
+def main_bootstrap(
+    filename: str,
+    out_path: str,
+    window: int,
+    n_replicates: int,
+    percentiles: List[float] = None,
+    n_workers: int = 1,
+    divergence=kld,
+    seed: int = 0,
+    chunk_size: int = 100,
+):
+    """
+    Draws n_replicates series from the mean distributions and their standard
+    errors (see resample_distributions) and computes the percentiles of
+    novelty, transience and resonance over the replicates
+    Writes to csv with a column for each signal and percentile, e.g. resonance_p2.5
+
+    The replicates are computed in chunks of chunk_size, in n_workers
+    processes. Each chunk has its own seed derived from seed, so the bands do
+    not depend on the number of workers. The default percentiles are 2.5, 50
+    and 97.5.
+    """
+    if percentiles is None:
+        percentiles = [2.5, 50, 97.5]
+    with open(filename) as f:
+        emo_file = ndjson.load(f)
+
+    _, time = get_data_time(emo_file)
+    mean, sd, n = get_moments(emo_file)
+
+    sizes = [chunk_size] * (n_replicates // chunk_size)
+    if n_replicates % chunk_size:
+        sizes.append(n_replicates % chunk_size)
+    chunks = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+    run = functools.partial(
+        bootstrap_chunk, mean=mean, sd=sd, n=n, window=window, divergence=divergence
+    )
+    if n_workers > 1:
+        with multiprocessing.Pool(n_workers) as pool:
+            results = pool.map(run, chunks)
+    else:
+        results = list(map(run, chunks))
+
+    df = pd.DataFrame({"date": time})
+    for name in results[0]:
+        signal = np.concatenate([result[name] for result in results])
+        for p, band in zip(percentiles, np.percentile(signal, percentiles, axis=0)):
+            df[f"{name}_p{p:g}"] = band
     df.to_csv(out_path, index=False)
 
 
-def main(filenames: List[str], window: int, extract_emos: str):
+def main(
+    filenames: List[str],
+    window: int,
+    extract_emos: str,
+    windows: List[int] = None,
+    n_workers: int = 1,
+    divergence: str = "kld",
+    epsilon: float = 0,
+    bootstrap: int = None,
+    percentiles: List[float] = None,
+    seed: int = 0,
+):
     if not os.path.exists("idmdl"):
         os.makedirs("idmdl")
 
+    # output files of other divergences than the one of newsFluxus are suffixed
+    suffix = "" if divergence == "kld" else f"_{divergence}"
+    if epsilon:
+        suffix += f"_eps{epsilon:g}"
+    divergence = get_divergence(divergence, epsilon)
+
+    if bootstrap:
+        for file in filenames:
+            start_time = timer.time()
+            filename = os.path.join("summarized_emo", f"{file}.ndjson")
+            out_name = f"{file}{suffix}_W{window}_bootstrap.csv"
+            out_path = os.path.join("idmdl", out_name)
+            main_bootstrap(
+                filename,
+                out_path,
+                window,
+                bootstrap,
+                percentiles,
+                n_workers,
+                divergence,
+                seed,
+            )
+            print(
+                f"Bootstrapped {file} with {bootstrap} replicates - time in s: {timer.time() - start_time:.3f}"
+            )
+
+    if n_workers > 1:
+        labels = {"emo": EMO_LABELS, "pol": POL_LABELS}.get(extract_emos, [])
+        main_parallel(
+            filenames, window, labels, windows, n_workers, divergence, suffix
+        )
+        return
+
     for file in filenames:
         filename = os.path.join("summarized_emo", f"{file}.ndjson")
-        out_path = os.path.join("idmdl", f"{file}_W{window}.csv")
-        main_extract(filename, out_path, window)
+        out_name = f"{file}{suffix}"
+        if windows:
+            out_path = os.path.join("idmdl", f"{out_name}_sweep.csv")
+            main_sweep(filename, out_path, windows, divergence)
+        else:
+            out_path = os.path.join("idmdl", f"{out_name}_W{window}.csv")
+            main_extract(filename, out_path, window, divergence)
 
         if extract_emos == "emo":
             out_folder = "idmdl"
-            extract_excluded_emos(filename, out_folder, file, window)
+            extract_excluded_emos(
+                filename, out_folder, out_name, window, divergence=divergence
+            )
         if extract_emos == "pol":
-            labels = ["positve", "neutral", "negative"]
             out_folder = "idmdl"
-            extract_excluded_emos(filename, out_folder, file, window, labels)
+            extract_excluded_emos(
+                filename, out_folder, out_name, window, POL_LABELS, divergence
+            )
 
 
 if __name__ == "__main__":
@@ -156,14 +451,82 @@ if __name__ == "__main__":
                                 The argument must be either "emo" or "pol", detmining whether the emotions come 
                                 from BERT emotion or BERT Tone.""",
     )
+    parser.add_argument(
+        "--windows",
+        type=int,
+        required=False,
+        nargs="+",
+        default=None,
+        help="If defined, the signals are calculated for each of these window sizes and written to one file with a window column (instead of --window).",
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of processes extracting the signals of the files (and excluded emotions) in parallel. Default is 1.",
+    )
+    parser.add_argument(
+        "--divergence",
+        type=str,
+        required=False,
+        default="kld",
+        choices=list(DIVERGENCES),
+        help="Divergence between the distributions: kld (as newsFluxus), jsd (Jensen-Shannon) or hellinger. Default is kld.",
+    )
+    parser.add_argument(
+        "--epsilon",
+        type=float,
+        required=False,
+        default=0,
+        help="If not 0, epsilon is added to each entry of the distributions (renormalized) before the divergences, e.g. to keep kld finite for distributions with zeros. Default is 0.",
+    )
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        required=False,
+        default=None,
+        help="If defined, number of replicates drawn from the stored n and emo_prob_sd of each time point to compute percentile bands of the signals (written to a _bootstrap.csv file).",
+    )
+    parser.add_argument(
+        "--percentiles",
+        type=float,
+        required=False,
+        nargs="+",
+        default=[2.5, 50, 97.5],
+        help="Percentiles of the bootstrap bands. Default is 2.5 50 97.5.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        required=False,
+        default=0,
+        help="Random seed of the bootstrap. Default is 0.",
+    )
     args = parser.parse_args()
 
     print(
         f"""Running emotionFluxus.py with:
              filenames={args.filenames},
              window={args.window},
-             extract_emos={args.extract_emotions}"""
+             extract_emos={args.extract_emotions},
+             windows={args.windows},
+             n_workers={args.n_workers},
+             divergence={args.divergence},
+             epsilon={args.epsilon},
+             bootstrap={args.bootstrap},
+             percentiles={args.percentiles},
+             seed={args.seed}"""
     )
     main(
-        filenames=args.filenames, window=args.window, extract_emos=args.extract_emotions
+        filenames=args.filenames,
+        window=args.window,
+        extract_emos=args.extract_emotions,
+        windows=args.windows,
+        n_workers=args.n_workers,
+        divergence=args.divergence,
+        epsilon=args.epsilon,
+        bootstrap=args.bootstrap,
+        percentiles=args.percentiles,
+        seed=args.seed,
     )
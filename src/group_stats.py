@@ -0,0 +1,395 @@
+"""
+Mergeable per-group statistics of probability distributions
+
+For every group the number of rows n, the mean and the sum of squared
+deviations from the mean (M2) of each class are kept. Statistics of chunks are
+merged exactly (Chan et al.), so the data can be aggregated chunk by chunk
+without holding the rows in memory. The standard deviation is sqrt(M2 / n),
+as np.std.
+
+Statistics of a fine grouping (e.g. date and hour) are rolled up into coarser
+groupings (day, week, month) by merging, without going back to the rows.
+
+Optionally, a histogram with n_bins equal bins over [0, 1] is kept per group
+and class, from which quantiles (e.g. the median) are estimated. Histograms
+merge exactly by adding the counts, and the error of a quantile is at most one
+bin width.
+"""
+import base64
+import datetime
+import re
+import zlib
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def chunk_moments(
+    codes: np.ndarray, n_groups: int, probs: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes n, mean and M2 of each group
+
+    Args:
+        codes (np.ndarray): group code (0, ..., n_groups - 1) of each row
+        n_groups (int): number of groups
+        probs (np.ndarray): probabilities of shape (rows, classes)
+
+    returns
+        n of shape (groups,), mean and M2 of shape (groups, classes)
+    """
+    n = np.bincount(codes, minlength=n_groups)
+    n_classes = probs.shape[1]
+    sums = np.empty((n_groups, n_classes))
+    for j in range(n_classes):
+        sums[:, j] = np.bincount(codes, weights=probs[:, j], minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / n[:, None]
+    dev = probs - mean[codes]
+    m2 = np.empty((n_groups, n_classes))
+    for j in range(n_classes):
+        m2[:, j] = np.bincount(codes, weights=dev[:, j] ** 2, minlength=n_groups)
+    return n, mean, m2
+
+
+def group_codes(df: pd.DataFrame, group_by: List[str]) -> Tuple[np.ndarray, list]:
+    """
+    returns the group code of each row of df and the keys (tuples) of the groups.
+    Each column is factorized on its own, which is much faster than
+    factorizing the tuples. Rows with a missing value in any of the columns get
+    code -1 and no group (as groupby drops them).
+    """
+    col_codes, col_keys = zip(*(pd.factorize(df[col]) for col in group_by))
+    shape = [max(len(keys), 1) for keys in col_keys]
+    valid = np.logical_and.reduce([c >= 0 for c in col_codes])
+    combined = np.ravel_multi_index([c[valid] for c in col_codes], shape)
+    codes = np.full(len(df), -1, dtype=np.intp)
+    codes[valid], uniques = pd.factorize(combined)
+    key_codes = np.unravel_index(uniques, shape)
+    keys = list(
+        zip(*(np.asarray(keys)[c].tolist() for keys, c in zip(col_keys, key_codes)))
+    )
+    return codes, keys
+
+
+def group_key(group) -> tuple:
+    """
+    returns the key of a group as written in the summaries: a string for one
+    column, a list for several
+    """
+    return tuple(group) if isinstance(group, list) else (group,)
+
+
+def merge_moments(a: tuple, b: tuple) -> tuple:
+    """
+    Merges the statistics (n, mean, M2) of two sets of rows
+    """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta**2 * (n_a * n_b / n)
+    return n, mean, m2
+
+
+def merge_groups(
+    codes: np.ndarray, n_groups: int, n: np.ndarray, mean: np.ndarray, m2: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merges the statistics of several groups into n_groups groups
+
+    Args:
+        codes (np.ndarray): merged group (0, ..., n_groups - 1) of each group
+        n (np.ndarray): n of each group, shape (groups,)
+        mean, m2 (np.ndarray): mean and M2 of each group, shape (groups, classes)
+
+    returns
+        n, mean and M2 of the merged groups
+    """
+    n_merged = np.bincount(codes, weights=n, minlength=n_groups)
+    n_classes = mean.shape[1]
+    mean_merged = np.empty((n_groups, n_classes))
+    m2_merged = np.empty((n_groups, n_classes))
+    for j in range(n_classes):
+        mean_merged[:, j] = (
+            np.bincount(codes, weights=n * mean[:, j], minlength=n_groups) / n_merged
+        )
+        # M2 of the merged group is the M2 of the parts plus their spread around the merged mean
+        spread = m2[:, j] + n * (mean[:, j] - mean_merged[codes, j]) ** 2
+        m2_merged[:, j] = np.bincount(codes, weights=spread, minlength=n_groups)
+    return n_merged.astype(np.int64), mean_merged, m2_merged
+
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def chunk_histograms(
+    codes: np.ndarray, n_groups: int, probs: np.ndarray, n_bins: int
+) -> np.ndarray:
+    """
+    returns the histogram of each group and class, shape (groups, classes, n_bins).
+    Rows with missing probabilities are not counted.
+    """
+    n_classes = probs.shape[1]
+    finite = np.isfinite(probs).all(axis=1)
+    codes, probs = codes[finite], probs[finite]
+    bins = np.clip((probs * n_bins).astype(np.int64), 0, n_bins - 1)
+    flat = (codes[:, None] * n_classes + np.arange(n_classes)) * n_bins + bins
+    counts = np.bincount(flat.ravel(), minlength=n_groups * n_classes * n_bins)
+    return counts.reshape(n_groups, n_classes, n_bins)
+
+
+def encode_hist(hist: np.ndarray) -> str:
+    """
+    Encodes a histogram of shape (classes, n_bins) compactly for the ndjson
+    summaries: zlib compressed uint32 counts in base64
+    """
+    return base64.b64encode(zlib.compress(hist.astype("<u4").tobytes())).decode()
+
+
+def decode_hist(encoded: str, n_bins: int) -> np.ndarray:
+    counts = np.frombuffer(zlib.decompress(base64.b64decode(encoded)), "<u4")
+    return counts.astype(np.int64).reshape(-1, n_bins)
+
+
+def hist_quantiles(hists: np.ndarray, quantiles: List[float]) -> np.ndarray:
+    """
+    Estimates quantiles from histograms over [0, 1], interpolating linearly
+    within the bins
+
+    Args:
+        hists (np.ndarray): counts of shape (..., n_bins)
+        quantiles (List[float]): quantiles between 0 and 1
+
+    returns
+        np.ndarray of shape (len(quantiles), ...), nan for empty histograms
+    """
+    n_bins = hists.shape[-1]
+    cum = np.cumsum(hists, axis=-1)
+    total = cum[..., -1:]
+    estimates = []
+    for q in quantiles:
+        target = q * total
+        # first bin where the cumulative count reaches the target
+        b = np.minimum((cum < target).sum(axis=-1, keepdims=True), n_bins - 1)
+        before = np.take_along_axis(cum, b, axis=-1) - np.take_along_axis(hists, b, axis=-1)
+        count = np.take_along_axis(hists, b, axis=-1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            within = np.where(count > 0, (target - before) / count, 0.5)
+        estimate = np.where(total > 0, (b + within) / n_bins, np.nan)
+        estimates.append(estimate[..., 0])
+    return np.array(estimates)
+
+
+def _week(key: tuple) -> tuple:
+    date = datetime.date.fromisoformat(key[0])
+    return ((date - datetime.timedelta(days=date.weekday())).isoformat(),)
+
+
+# time bins are aligned to monday 1970-01-05, so weeks start on mondays
+BIN_ORIGIN = 4 * 86400
+BIN_UNITS = {"min": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_bin_width(width: str) -> int:
+    """
+    returns the width of a time bin (e.g. 15min, 6h, 1d, 1w) in seconds
+    """
+    match = re.fullmatch(r"(\d+)(min|h|d|w)", width)
+    if not match:
+        raise ValueError(f"Unknown bin width {width}, use e.g. 15min, 6h, 1d or 1w")
+    return int(match.group(1)) * BIN_UNITS[match.group(2)]
+
+
+def bin_start(seconds, width: int):
+    """
+    returns the start of the bin of width seconds containing seconds (int or np.ndarray)
+    """
+    return (seconds - BIN_ORIGIN) // width * width + BIN_ORIGIN
+
+
+def time_bins(times: pd.Series, width: int, timezone: str = None) -> np.ndarray:
+    """
+    Bins tz-aware times into bins of width seconds
+
+    Args:
+        times (pd.Series): tz-aware times
+        width (int): bin width in seconds
+        timezone (str): e.g. Europe/Copenhagen. If defined, bins follow the
+            local clock, so days start at local midnight also across changes
+            of daylight saving time. Default is UTC.
+
+    returns
+        start of the bin of each time as integer seconds since 1970-01-01 on
+        the local clock
+    """
+    if timezone:
+        times = times.dt.tz_convert(timezone)
+    seconds = times.dt.tz_localize(None).to_numpy(dtype="datetime64[s]").astype(np.int64)
+    return bin_start(seconds, width)
+
+
+# rollups of a (date, hour) key, groups are named by their first day so
+# emotionFluxus.get_time can read them
+ROLLUPS = {
+    "date": lambda key: key[:1],
+    "week": _week,  # ISO week, starting monday
+    "month": lambda key: (key[0][:7] + "-01",),
+}
+STRFTIME_LEVELS = ["%Y", "%Y-%m", "%Y-%m-%d"]
+
+
+def get_rollup(level: str) -> Callable[[tuple], tuple]:
+    """
+    returns the function mapping a (date, hour) key to the key of level: one of
+    ROLLUPS or a strftime format of the date of the form %Y, %Y-%m or %Y-%m-%d
+    (e.g. "%Y" for years), which emotionFluxus.get_time can read
+    """
+    if level in ROLLUPS:
+        return ROLLUPS[level]
+    if level in STRFTIME_LEVELS:
+        return lambda key: (datetime.date.fromisoformat(key[0]).strftime(level),)
+    raise ValueError(
+        f"Unknown level {level}, use one of {list(ROLLUPS)} or {STRFTIME_LEVELS}"
+    )
+
+
+class GroupMoments:
+    """
+    Running statistics (n, mean, M2) per group. Memory is proportional to the
+    number of groups times the number of classes.
+
+    Args:
+        group_by (List[str]): columns defining the groups
+        n_bins (int): if defined, a histogram with n_bins bins is kept per
+            group and class for quantiles
+    """
+
+    def __init__(self, group_by: List[str], n_bins: int = None):
+        self.group_by = group_by
+        self.n_bins = n_bins
+        self.stats: Dict[tuple, tuple] = {}
+        self.hists: Dict[tuple, np.ndarray] = {}
+
+    @classmethod
+    def from_records(cls, records: List[dict], group_by: List[str], n_bins: int = None):
+        """
+        Reads the statistics back from summary records (see records), which
+        must include n, and histograms with n_bins bins if and only if n_bins
+        """
+        moments = cls(group_by, n_bins)
+        for record in records:
+            if record.get("emo_prob_hist_bins") != n_bins:
+                raise ValueError(
+                    f"The summary of group {record['group']} has histograms with {record.get('emo_prob_hist_bins')} bins, not {n_bins}"
+                )
+            if n_bins:
+                hist = decode_hist(record["emo_prob_hist"], n_bins)
+                moments.hists[group_key(record["group"])] = hist
+            if "n" not in record:
+                raise ValueError(
+                    f"The summary of group {record['group']} has no n, it can not be merged"
+                )
+            n = record["n"]
+            sd = np.array(record["emo_prob_sd"])
+            moments.stats[group_key(record["group"])] = (
+                n,
+                np.array(record["emo_prob"]),
+                sd**2 * n,
+            )
+        return moments
+
+    def merge(self, other):
+        """
+        Adds the statistics of other (GroupMoments with the same grouping)
+        """
+        for key, stats in other.stats.items():
+            if key in self.stats:
+                stats = merge_moments(self.stats[key], stats)
+            self.stats[key] = stats
+        for key, hist in other.hists.items():
+            self.hists[key] = self.hists[key] + hist if key in self.hists else hist
+
+    def update(self, df: pd.DataFrame, probs: np.ndarray):
+        """
+        Adds the rows of df with the probabilities probs (rows, classes)
+        """
+        codes, keys = group_codes(df, self.group_by)
+        valid = codes >= 0
+        codes, probs = codes[valid], probs[valid]
+        n, mean, m2 = chunk_moments(codes, len(keys), probs)
+        if self.n_bins:
+            hists = chunk_histograms(codes, len(keys), probs, self.n_bins)
+        for i, key in enumerate(keys):
+            stats = (int(n[i]), mean[i], m2[i])
+            if key in self.stats:
+                stats = merge_moments(self.stats[key], stats)
+            self.stats[key] = stats
+            if self.n_bins:
+                self.hists[key] = self.hists.get(key, 0) + hists[i]
+
+    def rollup(self, rollup: Callable[[tuple], tuple], group_by: List[str]):
+        """
+        Merges the groups into coarser groups
+
+        Args:
+            rollup (Callable): maps the key of a group to the key of the coarser group
+            group_by (List[str]): names of the columns of the coarser keys
+
+        returns
+            GroupMoments
+        """
+        rolled = GroupMoments(group_by, self.n_bins)
+        if not self.stats:
+            return rolled
+        keys = list(self.stats)
+        n, mean, m2 = (np.array(stat) for stat in zip(*self.stats.values()))
+        codes, new_keys = pd.MultiIndex.from_tuples(
+            [rollup(key) for key in keys]
+        ).factorize()
+        n, mean, m2 = merge_groups(codes, len(new_keys), n, mean, m2)
+        for i, key in enumerate(new_keys):
+            rolled.stats[key] = (int(n[i]), mean[i], m2[i])
+        if self.n_bins:
+            hists = np.zeros((len(new_keys), *self.hists[keys[0]].shape), np.int64)
+            np.add.at(hists, codes, np.array([self.hists[key] for key in keys]))
+            for i, key in enumerate(new_keys):
+                rolled.hists[key] = hists[i]
+        return rolled
+
+    def records(self) -> List[dict]:
+        """
+        returns the summary of each group sorted by group, with the group as a
+        string when grouping by one column and a list otherwise (as in the
+        summarized_emo files). With histograms, the records also hold the
+        encoded histograms (emo_prob_hist, see encode_hist) and the QUANTILES of each class
+        (emo_prob_quantiles).
+        """
+        keys = sorted(self.stats)
+        if not keys:
+            return []
+        n, mean, m2 = (np.array(stat) for stat in zip(*(self.stats[k] for k in keys)))
+        sd = np.sqrt(m2 / n[:, None])
+        records = [
+            {
+                "group": key[0] if len(key) == 1 else list(key),
+                "emo_prob": emo_prob,
+                "emo_prob_sd": emo_prob_sd,
+                "n": int(n_group),
+            }
+            for key, n_group, emo_prob, emo_prob_sd in zip(
+                keys, n, mean.tolist(), sd.tolist()
+            )
+        ]
+        if self.n_bins:
+            hists = np.array([self.hists[key] for key in keys])
+            quantiles = hist_quantiles(hists, QUANTILES).round(6)
+            for i, record in enumerate(records):
+                record["emo_prob_quantiles"] = {
+                    str(q): quantiles[j, i].tolist() for j, q in enumerate(QUANTILES)
+                }
+                record["emo_prob_hist"] = encode_hist(hists[i])
+                record["emo_prob_hist_bins"] = self.n_bins
+        return records
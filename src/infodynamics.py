@@ -0,0 +1,469 @@
+"""
+Novelty, transience and resonance of a series of probability distributions
+
+Vectorized port of the InfoDynamics model of newsFluxus
+(https://github.com/centre-for-humanities-computing/newsFluxus), giving the
+same values:
+- novelty: mean divergence of each distribution from the window previous ones
+- transience: mean divergence of each distribution from the window next ones
+- resonance: novelty - transience
+together with their standard deviations (nsigma, tsigma, rsigma). The first
+window values of novelty and resonance and the last window values of
+transience and resonance are 0.
+
+Instead of looping over time points, the divergences at each lag 1, ...,
+window are computed for the whole (T x K) array at once. Leading dimensions
+are batch dimensions, e.g. (K x T x K-1) for the series leaving out one class
+at a time (see leave_one_out). sweep_windows
+computes this band of divergences once for the largest window and derives the
+signals of all windows from cumulative sums over the band. OnlineInfoDynamics
+computes the same values one time point at a time, as new data arrives.
+
+The divergence is the one of newsFluxus (kld) by default. Jensen-Shannon
+(jsd) and Hellinger distances stay finite where distributions have zero
+entries, and any of them can be computed on epsilon smoothed distributions
+(see get_divergence).
+
+resample_distributions draws replicate series from the sampling distribution
+of mean distributions, to get bootstrap bands of the signals by computing
+them for all replicates as one batch.
+"""
+import functools
+
+import numpy as np
+import pandas as pd
+
+
+def kld_terms(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    returns the terms of the divergence of newsFluxus, (p - q) * log10(p / q)
+    where p is not 0, element-wise
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(p != 0, (p - q) * np.log10(p / q), 0)
+
+
+def kld(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    returns the divergence between the distributions in the last axis of p and q
+    """
+    return kld_terms(p, q).sum(axis=-1)
+
+
+def jsd(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    returns the Jensen-Shannon divergence (log2, between 0 and 1) between the
+    distributions in the last axis of p and q
+    """
+    m = (p + q) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_terms = np.where(p != 0, p * np.log2(p / m), 0)
+        q_terms = np.where(q != 0, q * np.log2(q / m), 0)
+    return (p_terms + q_terms).sum(axis=-1) / 2
+
+
+def hellinger(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    returns the Hellinger distance (between 0 and 1) between the distributions
+    in the last axis of p and q
+    """
+    return np.sqrt(((np.sqrt(p) - np.sqrt(q)) ** 2).sum(axis=-1) / 2)
+
+
+DIVERGENCES = {"kld": kld, "jsd": jsd, "hellinger": hellinger}
+
+
+def smooth(p: np.ndarray, epsilon: float) -> np.ndarray:
+    """
+    returns the distributions in the last axis of p with epsilon added to
+    each entry, renormalized to sum to 1
+    """
+    p = p + epsilon
+    return p / p.sum(axis=-1, keepdims=True)
+
+
+def smoothed_divergence(p: np.ndarray, q: np.ndarray, divergence, epsilon: float):
+    """
+    returns the divergence between the epsilon smoothed distributions
+    """
+    return divergence(smooth(p, epsilon), smooth(q, epsilon))
+
+
+def get_divergence(name: str = "kld", epsilon: float = 0):
+    """
+    returns the divergence function (p, q) -> divergence over the last axis
+
+    Args:
+        name (str): kld (newsFluxus), jsd (Jensen-Shannon) or hellinger
+        epsilon (float): if not 0, the distributions are smoothed by adding
+            epsilon to each entry (and renormalizing), e.g. to keep kld finite
+            on distributions with zeros
+    """
+    if name not in DIVERGENCES:
+        raise ValueError(f"divergence must be one of {list(DIVERGENCES)}, not {name}")
+    if not epsilon:
+        return DIVERGENCES[name]
+    return functools.partial(
+        smoothed_divergence, divergence=DIVERGENCES[name], epsilon=epsilon
+    )
+
+
+def lagged_divergences(data: np.ndarray, window: int, divergence=kld) -> tuple:
+    """
+    Computes the divergences of each distribution to the window previous and
+    next ones
+
+    Args:
+        data (np.ndarray): distributions of shape (..., T, K)
+        window (int): largest lag
+        divergence (callable): divergence over the last axis, see get_divergence
+
+    returns
+        past, future: arrays of shape (..., T, window), past[i, d - 1] is
+        divergence(data[i], data[i - d]) and future[i, d - 1] is
+        divergence(data[i], data[i + d]), nan where i - d or i + d is outside
+        the series
+    """
+    m = data.shape[-2]
+    past = np.full((*data.shape[:-1], window), np.nan)
+    future = np.full((*data.shape[:-1], window), np.nan)
+    for d in range(1, min(window, m - 1) + 1):
+        past[..., d:, d - 1] = divergence(data[..., d:, :], data[..., :-d, :])
+        future[..., :-d, d - 1] = divergence(data[..., :-d, :], data[..., d:, :])
+    return past, future
+
+
+def window_mean_std(div: np.ndarray, has_data: np.ndarray) -> tuple:
+    """
+    returns mean and standard deviation over the (non nan) divergences of
+    each row, 0 where the window has no data (as newsFluxus)
+    """
+    valid = ~np.isnan(div)
+    count = valid.sum(axis=-1)
+    empty = (count == 0) | ~has_data
+    total = np.where(valid, div, 0).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / count
+        sq_dev = np.where(valid, (div - mean[..., None]) ** 2, 0).sum(axis=-1)
+        std = np.sqrt(sq_dev / count)
+    mean[empty] = 0
+    std[empty] = 0
+    return mean, std
+
+
+def window_has_data(data: np.ndarray, window: int) -> tuple:
+    """
+    returns whether any of the window previous and next distributions has a
+    non-zero entry (newsFluxus treats all-zero windows as empty)
+    """
+    m = data.shape[-2]
+    nonzero = np.cumsum(data.any(axis=-1), axis=-1)
+    nonzero = np.concatenate([np.zeros((*nonzero.shape[:-1], 1), int), nonzero], axis=-1)
+    i = np.arange(m)
+    past = nonzero[..., i] - nonzero[..., np.maximum(i - window, 0)] > 0
+    future = nonzero[..., np.minimum(i + window + 1, m)] - nonzero[..., i + 1] > 0
+    return past, future
+
+
+def cumulative_mean_std(div: np.ndarray, windows: list, has_data: dict) -> dict:
+    """
+    Computes mean and standard deviation over the first w (non nan)
+    divergences of each row for each w in windows, from cumulative sums
+
+    Args:
+        div (np.ndarray): divergences of shape (..., T, max(windows)), see lagged_divergences
+        windows (list): window sizes
+        has_data (dict): for each window, whether the window of each row has data
+
+    returns
+        dict: window: (mean, std)
+    """
+    valid = ~np.isnan(div)
+    div = np.where(valid, div, 0)
+    # shifting by the first divergence of the row keeps the sums of squares
+    # small, so the variance does not suffer from cancellation
+    shift = np.where(np.isfinite(div[..., :1]), div[..., :1], 0)
+    dev = np.where(valid, div - shift, 0)
+    count = np.cumsum(valid, axis=-1)
+    sum_dev = np.cumsum(dev, axis=-1)
+    with np.errstate(invalid="ignore"):
+        sum_sq = np.cumsum(dev**2, axis=-1)
+    stats = {}
+    for w in windows:
+        n = count[..., w - 1]
+        empty = (n == 0) | ~has_data[w]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_dev = sum_dev[..., w - 1] / n
+            var = sum_sq[..., w - 1] / n - mean_dev**2
+            mean = mean_dev + shift[..., 0]
+            std = np.sqrt(np.maximum(var, 0))
+        std[np.isnan(var)] = np.nan
+        mean[empty] = 0
+        std[empty] = 0
+        stats[w] = (mean, std)
+    return stats
+
+
+def _signals(novelty, nsigma, transience, tsigma, window: int) -> dict:
+    """
+    returns the signals with the edges set to 0 as in newsFluxus
+    """
+    transience[..., -window:] = 0
+    with np.errstate(invalid="ignore"):  # inf - inf where a distribution has zeros
+        resonance = novelty - transience
+    resonance[..., :window] = 0
+    resonance[..., -window:] = 0
+    rsigma = (nsigma + tsigma) / 2
+    rsigma[..., :window] = 0
+    rsigma[..., -window:] = 0
+    return {
+        "novelty": novelty,
+        "transience": transience,
+        "resonance": resonance,
+        "nsigma": nsigma,
+        "tsigma": tsigma,
+        "rsigma": rsigma,
+    }
+
+
+def novelty_transience_resonance(data, window: int, divergence=kld) -> dict:
+    """
+    Computes novelty, transience and resonance
+
+    Args:
+        data (array-like): distributions of shape (..., T, K), in time order
+        window (int): number of time points before and after each point
+        divergence (callable): divergence over the last axis, see get_divergence
+
+    returns
+        dict: novelty, transience, resonance, nsigma, tsigma, rsigma as arrays of shape (..., T)
+    """
+    data = np.asarray(data, dtype=np.float64)
+    past, future = lagged_divergences(data, window, divergence)
+    past_data, future_data = window_has_data(data, window)
+    # newsFluxus only uses full past windows
+    past_data[..., :window] = False
+
+    novelty, nsigma = window_mean_std(past, past_data)
+    transience, tsigma = window_mean_std(future, future_data)
+    return _signals(novelty, nsigma, transience, tsigma, window)
+
+
+def sweep_windows(data, windows: list, divergence=kld) -> dict:
+    """
+    Computes novelty, transience and resonance for several window sizes. The
+    divergences are computed once, for the largest window.
+
+    Args:
+        data (array-like): distributions of shape (..., T, K), in time order
+        windows (list): window sizes
+        divergence (callable): divergence over the last axis, see get_divergence
+
+    returns
+        dict: window: signals (see novelty_transience_resonance)
+    """
+    data = np.asarray(data, dtype=np.float64)
+    windows = sorted(set(windows))
+    past, future = lagged_divergences(data, windows[-1], divergence)
+    past_data, future_data = {}, {}
+    for w in windows:
+        past_data[w], future_data[w] = window_has_data(data, w)
+        past_data[w][..., :w] = False
+    past_stats = cumulative_mean_std(past, windows, past_data)
+    future_stats = cumulative_mean_std(future, windows, future_data)
+    return {
+        w: _signals(*past_stats[w], *future_stats[w], w) for w in windows
+    }
+
+
+def leave_one_out(data, classes: list = None) -> np.ndarray:
+    """
+    Removes each class in turn and renormalizes the remaining classes to sum to 1
+
+    Args:
+        data (array-like): distributions of shape (T, K)
+        classes (list): indices of the classes to leave out. Defaults to all.
+
+    returns
+        np.ndarray of shape (len(classes), T, K - 1), where [i] is the series
+        without class classes[i]
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n_classes = data.shape[-1]
+    if classes is None:
+        classes = range(n_classes)
+    if any(not 0 <= k < n_classes for k in classes):
+        raise ValueError(
+            f"classes must be between 0 and {n_classes - 1}, not {list(classes)}"
+        )
+    keep = np.array([[j for j in range(n_classes) if j != k] for k in classes])
+    excluded = np.moveaxis(data[:, keep], 1, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return excluded / excluded.sum(axis=-1, keepdims=True)
+
+
+class OnlineInfoDynamics:
+    """
+    Computes novelty, transience and resonance one time point at a time, giving
+    the same values as novelty_transience_resonance on the whole series
+
+    Keeps a ring buffer of the last window + 1 distributions (and their
+    novelty), so an update costs O(window * K). The novelty of a new time point
+    is known at once, its transience and resonance when the window next time
+    points have arrived.
+
+    Args:
+        window (int): number of time points before and after each point
+        divergence (callable): divergence over the last axis, see get_divergence
+
+    Example:
+        >>> online = OnlineInfoDynamics(window=3)
+        >>> for date, distribution in stream:
+        ...     new, done = online.update(distribution, date)
+        ...     if done:
+        ...         print(done["date"], done["resonance"])
+        >>> rest = online.finish()
+    """
+
+    def __init__(self, window: int, divergence=kld):
+        self.window = window
+        self.divergence = divergence
+        self.n = 0  # number of time points seen
+        self._data = None  # (window + 1, K), time point i is at i % (window + 1)
+        self._time = [None] * (window + 1)
+        self._novelty = np.zeros(window + 1)
+        self._nsigma = np.zeros(window + 1)
+
+    def _rows(self, points) -> np.ndarray:
+        return self._data[np.asarray(points, dtype=int) % (self.window + 1)]
+
+    def _future(self, i: int) -> tuple:
+        """
+        returns the divergences of time point i to the (up to) window next ones
+        seen, nan padded, and whether they have data
+        """
+        nxt = self._rows(range(i + 1, min(i + self.window + 1, self.n)))
+        future = np.full(self.window, np.nan)
+        future[: len(nxt)] = self.divergence(self._rows([i]), nxt)
+        return future, nxt.any()
+
+    def _record(self, i: int, transience: float, tsigma: float) -> dict:
+        slot = i % (self.window + 1)
+        novelty, nsigma = self._novelty[slot], self._nsigma[slot]
+        if self.window <= i < self.n - self.window:
+            with np.errstate(invalid="ignore"):
+                resonance = novelty - transience
+            rsigma = (nsigma + tsigma) / 2
+        else:
+            transience = transience if i < self.n - self.window else 0.0
+            resonance, rsigma = 0.0, 0.0
+        return {
+            "index": i,
+            "date": self._time[slot],
+            "novelty": novelty,
+            "transience": transience,
+            "resonance": resonance,
+            "nsigma": nsigma,
+            "tsigma": tsigma,
+            "rsigma": rsigma,
+        }
+
+    def update(self, distribution, time=None) -> tuple:
+        """
+        Adds the distribution of the next time point
+
+        Args:
+            distribution (array-like): distribution of shape (K,)
+            time: time of the time point, returned with its signals
+
+        returns
+            new (dict): index, date, novelty and nsigma of the new time point
+            done (dict): all signals (see novelty_transience_resonance) of the
+                time point window steps back, None until window time points have arrived
+        """
+        distribution = np.asarray(distribution, dtype=np.float64)
+        if self._data is None:
+            self._data = np.zeros((self.window + 1, len(distribution)))
+        t = self.n
+        slot = t % (self.window + 1)
+        self._data[slot] = distribution
+        self._time[slot] = time
+        self.n += 1
+
+        novelty, nsigma = 0.0, 0.0
+        if t >= self.window:  # newsFluxus only uses full past windows
+            prev = self._rows(range(t - self.window, t)[::-1])
+            past = self.divergence(distribution, prev)
+            mean, std = window_mean_std(past[None], np.array([prev.any()]))
+            novelty, nsigma = mean[0], std[0]
+        self._novelty[slot], self._nsigma[slot] = novelty, nsigma
+        new = {"index": t, "date": time, "novelty": novelty, "nsigma": nsigma}
+
+        done = None
+        i = t - self.window
+        if i >= 0:
+            future, has_data = self._future(i)
+            mean, std = window_mean_std(future[None], np.array([has_data]))
+            done = self._record(i, mean[0], std[0])
+        return new, done
+
+    def finish(self) -> list:
+        """
+        Ends the series
+
+        returns
+            list: the signals of the last window time points (transience and
+            resonance are 0 at the end of the series)
+        """
+        done = []
+        for i in range(max(self.n - self.window, 0), self.n):
+            future, has_data = self._future(i)
+            mean, std = window_mean_std(future[None], np.array([has_data]))
+            done.append(self._record(i, mean[0], std[0]))
+        return done
+
+
+def resample_distributions(
+    mean, sd, n, n_replicates: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Draws replicates of a series of mean distributions (parametric bootstrap).
+    Each mean is drawn from its normal sampling distribution, with standard
+    error sd / sqrt(n) independently for each class, clipped at 0 and
+    renormalized to sum to 1. Means of no observations (n = 0) are kept as they are.
+
+    Args:
+        mean (array-like): mean distributions of shape (T, K)
+        sd (array-like): standard deviations of the probabilities of each class, shape (T, K)
+        n (array-like): number of observations of each mean, shape (T,)
+        n_replicates (int): number of replicates
+        rng (np.random.Generator): random number generator
+
+    returns
+        np.ndarray of shape (n_replicates, T, K)
+    """
+    mean = np.asarray(mean, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)[:, None]
+    se = np.divide(
+        np.asarray(sd, dtype=np.float64),
+        np.sqrt(n),
+        out=np.zeros_like(mean),
+        where=n > 0,
+    )
+    draws = mean + se * rng.standard_normal((n_replicates, *mean.shape))
+    np.clip(draws, 0, None, out=draws)
+    total = draws.sum(axis=-1, keepdims=True)
+    return np.divide(draws, total, out=np.zeros_like(draws), where=total > 0)
+
+
+def extract_novelty_resonance(
+    df: pd.DataFrame, theta, dates, window: int, divergence=kld
+) -> pd.DataFrame:
+    """
+    Adds novelty, transience, resonance, nsigma, tsigma and rsigma of the
+    distributions theta to df (same interface as newsFluxus)
+    """
+    signals = novelty_transience_resonance(np.array(list(theta)), window, divergence)
+    for name, signal in signals.items():
+        df[name] = signal
+    return df
@@ -0,0 +1,134 @@
+"""
+Streaming reader for tweets in ndjson files
+
+Shared by tweets_bert.py, tweets_topic.py and coherence_topics.py.
+- reads plain, gzip (.gz) and zstandard (.zst, requires zstandard) compressed files
+- uses orjson for decoding if it is installed
+- only keeps the requested fields of each post
+- filters retweets on the raw bytes before decoding the post
+"""
+import gzip
+import io
+import json
+import re
+from glob import glob
+from typing import List
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+COMPRESSED_EXTENSIONS = (".gz", ".zst")
+
+
+def is_compressed(in_file: str) -> bool:
+    return in_file.endswith(COMPRESSED_EXTENSIONS)
+
+
+def open_ndjson(in_file: str):
+    """
+    Opens in_file for reading bytes, decompressing .gz and .zst files
+    """
+    if in_file.endswith(".gz"):
+        return io.BufferedReader(gzip.open(in_file, "rb"), buffer_size=1024**2)
+    if in_file.endswith(".zst"):
+        import zstandard
+
+        raw = open(in_file, "rb")
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.BufferedReader(reader, buffer_size=1024**2)
+    return open(in_file, "rb")
+
+
+def _skip(f, n_bytes: int):
+    """
+    Moves n_bytes forward in f. Compressed streams are read and discarded.
+    """
+    if f.seekable():
+        f.seek(n_bytes)
+        return
+    while n_bytes > 0:
+        chunk = f.read(min(n_bytes, 1024**2))
+        if not chunk:
+            break
+        n_bytes -= len(chunk)
+
+
+def read_ndjson_file(
+    in_file: str,
+    fields: List[str] = None,
+    text_field: str = "text",
+    skip_retweets: bool = True,
+    start: int = 0,
+    end: int = None,
+):
+    """
+    Yields the posts of in_file between byte start and end (end of file if None).
+    Empty posts are removed. The position after each post, (file, byte offset),
+    is added as "_position". Offsets of compressed files are in the decompressed data.
+
+    Args:
+        in_file (str): path of the ndjson file
+        fields (List[str]): fields to keep. If None all fields are kept.
+        text_field (str): field with the text of the post
+        skip_retweets (bool): whether retweets (text starting with RT) are removed
+        start (int): byte offset to start reading from, must be the start of a line
+        end (int): byte offset to stop reading at
+    """
+    # only used on lines with a single text field, as nested posts (e.g. quoted
+    # tweets) could also contain one
+    rt_key = f'"{text_field}"'.encode()
+    rt_pattern = re.compile(rb'"' + text_field.encode() + rb'"\s*:\s*"RT')
+    offset = start
+    with open_ndjson(in_file) as f:
+        if start:
+            _skip(f, start)
+        for line in f:
+            if end is not None and offset >= end:
+                break
+            offset += len(line)
+            if not line.strip():
+                continue
+            if (
+                skip_retweets
+                and line.count(rt_key) == 1
+                and rt_pattern.search(line)
+            ):
+                continue
+            post = loads(line)
+            if not post:  # remove empty posts
+                continue
+            if skip_retweets and post[text_field].startswith("RT"):
+                continue
+            if fields:
+                post = {field: post[field] for field in fields if field in post}
+            post["_position"] = (in_file, offset)
+            yield post
+
+
+def ndjson_gen(
+    filepath: str,
+    fields: List[str] = None,
+    text_field: str = "text",
+    skip_retweets: bool = True,
+    start_file: str = None,
+    start_offset: int = 0,
+):
+    """
+    Yields the posts of all files matching filepath (in sorted order), see
+    read_ndjson_file. If start_file is given, the files before it are skipped
+    and reading starts at byte start_offset of start_file.
+    """
+    files = sorted(glob(filepath))
+    if start_file:
+        if start_file not in files:
+            raise ValueError(f"Checkpoint file {start_file} not found in {filepath}")
+        files = files[files.index(start_file) :]
+    for in_file in files:
+        start = start_offset if in_file == start_file else 0
+        yield from read_ndjson_file(
+            in_file, fields, text_field, skip_retweets, start=start
+        )
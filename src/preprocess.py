@@ -6,6 +6,34 @@ https://github.com/marissala/HOPE-keyword-query-Twitter
 '''
 ### Load modules ###
 import re
+from multiprocessing import Pool
+from typing import List
+
+### Patterns ###
+MENTION_PATTERN = re.compile(r'@(\S*)\w')
+HASHTAG_PATTERN = re.compile(r'#\S*\w')
+URL_PATTERN = re.compile(
+    r'(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}|www\.[a-zA-Z0-9]+\.[^\s]{2,})')
+EMOJI_PATTERN = re.compile("["
+                           u"\U0001F600-\U0001F64F"  # emoticons
+                           u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+                           u"\U0001F680-\U0001F6FF"  # transport & map symbols
+                           u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+                           u"\U00002500-\U00002BEF"  # chinese char
+                           u"\U00002702-\U000027B0"
+                           u"\U00002702-\U000027B0"
+                           u"\U000024C2-\U0001F251"
+                           u"\U0001f926-\U0001f937"
+                           u"\U00010000-\U0010ffff"
+                           u"\u2640-\u2642"
+                           u"\u2600-\u2B55"
+                           u"\u200d"
+                           u"\u23cf"
+                           u"\u23e9"
+                           u"\u231a"
+                           u"\ufe0f"  # dingbats
+                           u"\u3030"
+                           "]+", flags=re.UNICODE)
 
 ### Functions ###
 def remove_retweets(data):
@@ -25,27 +53,7 @@ def remove_emoji(string:str):
     string: str
     From Maris code: preprocess_stats.py
     """
-    emoji_pattern = re.compile("["
-                               u"\U0001F600-\U0001F64F"  # emoticons
-                               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                               u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                               u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                               u"\U00002500-\U00002BEF"  # chinese char
-                               u"\U00002702-\U000027B0"
-                               u"\U00002702-\U000027B0"
-                               u"\U000024C2-\U0001F251"
-                               u"\U0001f926-\U0001f937"
-                               u"\U00010000-\U0010ffff"
-                               u"\u2640-\u2642"
-                               u"\u2600-\u2B55"
-                               u"\u200d"
-                               u"\u23cf"
-                               u"\u23e9"
-                               u"\u231a"
-                               u"\ufe0f"  # dingbats
-                               u"\u3030"
-                               "]+", flags=re.UNICODE)
-    return emoji_pattern.sub(r'', string)
+    return EMOJI_PATTERN.sub(r'', string)
 
 
 def clean_tweets(tweet):
@@ -53,16 +61,48 @@ def clean_tweets(tweet):
     row: pandas DataFrame row with column "text"
     From Maris code: preprocess_stats.py
     """
-    clean_tweet = re.sub(r'@(\S*)\w', '', tweet) #mentions
-    clean_tweet = re.sub(r'#\S*\w', '', clean_tweet) # hashtags
-    # Remove URLs
-    url_pattern = re.compile(
-        r'(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}|www\.[a-zA-Z0-9]+\.[^\s]{2,})')
-    clean_tweet = re.sub(url_pattern, '', clean_tweet)
-    clean_tweet = remove_emoji(clean_tweet)
+    # the patterns are only run when the tweet can contain a match
+    clean_tweet = tweet
+    if '@' in clean_tweet:
+        clean_tweet = MENTION_PATTERN.sub('', clean_tweet) #mentions
+    if '#' in clean_tweet:
+        clean_tweet = HASHTAG_PATTERN.sub('', clean_tweet) # hashtags
+    if 'http' in clean_tweet or 'www' in clean_tweet:
+        clean_tweet = URL_PATTERN.sub('', clean_tweet) # URLs
+    if not clean_tweet.isascii():
+        clean_tweet = EMOJI_PATTERN.sub('', clean_tweet) # emojis
     return clean_tweet
 
 
+def _clean_chunk(tweets:List[str]):
+    """Cleans a list of tweets, retweets are not cleaned (None)
+    """
+    return [None if tweet.startswith('RT') else clean_tweets(tweet) for tweet in tweets]
+
+
+def clean_tweets_batch(tweets:List[str], n_workers:int=1, chunksize:int=10000):
+    """Cleans a batch of tweets (same output as clean_tweets) and flags retweets
+    and tweets that are empty after cleaning, so they can be left out before the models
+    tweets: list of str
+    n_workers: number of processes, if more than 1 chunks of tweets are cleaned in a process pool
+    chunksize: number of tweets per chunk sent to a process
+
+    returns
+        cleaned (list of str, None for retweets), is_retweet (list of bool), is_empty (list of bool)
+    """
+    tweets = list(tweets)
+    if n_workers > 1:
+        chunks = [tweets[i:i + chunksize] for i in range(0, len(tweets), chunksize)]
+        with Pool(n_workers) as pool:
+            cleaned = [tweet for chunk in pool.map(_clean_chunk, chunks) for tweet in chunk]
+    else:
+        cleaned = _clean_chunk(tweets)
+    is_retweet = [tweet is None for tweet in cleaned]
+    # only "" gives a Doc without tokens (which the models skip), whitespace is a token
+    is_empty = [tweet == "" for tweet in cleaned]
+    return cleaned, is_retweet, is_empty
+
+
 def remove_quote_tweets(df):
     """Creates mentioneless_text, remove bot-like tweets/quote tweets, when 50 first characters are the exact
     same, remove as duplicates
@@ -70,7 +110,7 @@ def remove_quote_tweets(df):
     From Maris code: preprocess_stats.py
     """
     df["text"] = df["text"].astype(str)
-    df["mentioneless_text"] = df.apply(lambda row: remove_mentions(row), axis = 1)
+    df["mentioneless_text"] = df["text"].str.replace(MENTION_PATTERN, '', regex=True)
     # print("Generated mentioneless texts")
     df["text50"] = df["mentioneless_text"].str[0:50]
     
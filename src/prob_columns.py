@@ -0,0 +1,126 @@
+"""
+Storage of probability distributions as numeric columns
+
+The classification output stores each class probability of a distribution
+column (e.g. Bert_emo_emotion_prob) as its own float32 column
+(Bert_emo_emotion_prob_0, Bert_emo_emotion_prob_1, ...). Older outputs store the
+distribution as the string of a numpy array, e.g. "[0.1 0.5 0.4]".
+read_prob_matrix reads both into a 2-D numpy array.
+"""
+import argparse
+import re
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+def prob_column_names(col: str, n_classes: int) -> List[str]:
+    """
+    returns the names of the columns with the class probabilities of col
+    """
+    return [f"{col}_{i}" for i in range(n_classes)]
+
+
+def expand_columns(columns: List[str], n_classes: Dict[str, int]) -> List[str]:
+    """
+    Replaces the distribution columns in the header by a column per class
+
+    Args:
+        columns (List[str]): header
+        n_classes (Dict[str, int]): number of classes of each distribution column
+    """
+    expanded = []
+    for col in columns:
+        if col in n_classes:
+            expanded += prob_column_names(col, n_classes[col])
+        else:
+            expanded.append(col)
+    return expanded
+
+
+def find_prob_columns(columns: List[str], col: str) -> List[str]:
+    """
+    returns the columns holding the distribution col: [col] if it is stored as
+    strings, otherwise the columns with the class probabilities in class order
+    """
+    if col in columns:
+        return [col]
+    pattern = re.compile(rf"^{re.escape(col)}_(\d+)$")
+    found = sorted(
+        (int(match.group(1)), c) for c in columns if (match := pattern.match(c))
+    )
+    if not found:
+        raise KeyError(f"No column {col} or probability columns {col}_<i> found")
+    return [c for _, c in found]
+
+
+def parse_prob_strings(values: pd.Series, dtype=np.float64) -> np.ndarray:
+    """
+    Parses distributions stored as strings ("[0.1 0.5 0.4]" or "[0.1, 0.5, 0.4]")
+    into a 2-D array. Rows containing nan (the topic model sometimes predicts nan
+    and inf) become 0 for nan and 1 for all other classes, as in
+    summarize_models.get_emotion_distribution. Missing values give rows of nan.
+    """
+    missing = values.isna().to_numpy()
+    split = values.str.replace(r"[\[\],]", " ", regex=True).str.split(expand=True)
+    probs = split.to_numpy(dtype=np.float64)
+    has_nan = np.isnan(probs).any(axis=1) & ~missing
+    probs[has_nan] = ~np.isnan(probs[has_nan])
+    return probs.astype(dtype)
+
+
+def read_prob_matrix(df: pd.DataFrame, col: str, dtype=np.float64) -> np.ndarray:
+    """
+    returns the distribution col of df as an array of shape (rows, classes),
+    both for class columns and for distributions stored as strings
+    """
+    cols = find_prob_columns(list(df.columns), col)
+    if cols == [col]:
+        return parse_prob_strings(df[col], dtype)
+    return df[cols].to_numpy(dtype=dtype)
+
+
+def convert_csv(
+    in_filepath: str, out_filepath: str, prob_cols: List[str], chunksize: int = 100000
+):
+    """
+    Converts a classification csv with distributions stored as strings into one
+    with a float32 column per class
+    """
+    chunks = pd.read_csv(in_filepath, header=0, index_col=0, chunksize=chunksize)
+    for i, chunk in enumerate(chunks):
+        for col in prob_cols:
+            probs = parse_prob_strings(chunk[col], np.float32)
+            position = chunk.columns.get_loc(col)
+            chunk = chunk.drop(columns=col)
+            for j, name in enumerate(prob_column_names(col, probs.shape[1])):
+                chunk.insert(position + j, name, probs[:, j])
+        chunk.to_csv(out_filepath, mode="w" if i == 0 else "a", header=i == 0)
+        print(f"converted chunk {i}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--in_filepath", type=str, required=True, help="Path of the csv to convert."
+    )
+    parser.add_argument(
+        "--out_filepath", type=str, required=True, help="Path of the converted csv."
+    )
+    parser.add_argument(
+        "--prob_cols",
+        type=str,
+        required=True,
+        nargs="+",
+        help="Columns with distributions stored as strings (e.g. Bert_emo_emotion_prob polarity_prob).",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"""Running prob_columns.py with:
+             in_filepath={args.in_filepath},
+             out_filepath={args.out_filepath},
+             prob_cols={args.prob_cols}"""
+    )
+    convert_csv(args.in_filepath, args.out_filepath, args.prob_cols)
@@ -0,0 +1,253 @@
+"""
+Buffered result sinks for writing classification output
+
+Rows are kept in memory and written to disk in large batches instead of
+reopening the output file for every classified tweet.
+
+Backends:
+- csv (default, same layout as pandas.DataFrame.to_csv)
+- parquet (requires pyarrow)
+- arrow (Arrow IPC file, requires pyarrow)
+"""
+import atexit
+import csv
+import io
+import os
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional
+
+
+class ResultSink(ABC):
+    """
+    Base class for buffered result sinks.
+
+    Rows are buffered until either max_rows rows or max_bytes bytes are held,
+    after which the buffer is flushed to disk. Use as a context manager (or call
+    close) to make sure the last rows are written; unclosed sinks are flushed
+    when the interpreter exits. When the with block exits with an exception,
+    the buffered rows are written but on_flush is not called.
+
+    Each row can be written with a progress tag (e.g. its position in the
+    input). progress is the tag of the last buffered row, so in on_flush it
+    belongs to the last row on disk.
+
+    Args:
+        filepath (str): path of the output file
+        columns (List[str]): header of the output file
+        max_rows (int): number of buffered rows that triggers a flush
+        max_bytes (int): (approximate) buffer size in bytes that triggers a flush
+        append (bool): append to an existing file instead of creating a new one
+        on_flush (Optional[Callable]): called with the sink after each flush
+    """
+
+    extension = ""
+
+    def __init__(
+        self,
+        filepath: str,
+        columns: List[str],
+        max_rows: int = 100000,
+        max_bytes: int = 64 * 1024**2,
+        append: bool = False,
+        on_flush: Optional[Callable[["ResultSink"], None]] = None,
+    ):
+        self.filepath = filepath
+        self.columns = columns
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.append = append
+        self.on_flush = on_flush
+        self.progress = None
+        self.n_written = 0
+        self._n_rows = 0
+        self._n_bytes = 0
+        self._closed = False
+        atexit.register(self.close)
+
+    def write(self, row: list, progress=None):
+        """
+        Adds a row to the buffer and flushes if the buffer is full
+
+        Args:
+            row (list): the row
+            progress: progress tag of the row, see ResultSink
+        """
+        self._n_bytes += self._add(row)
+        self._n_rows += 1
+        self.progress = progress
+        if self._n_rows >= self.max_rows or self._n_bytes >= self.max_bytes:
+            self.flush()
+
+    @property
+    def n_buffered(self) -> int:
+        """
+        number of rows in the buffer that are not written yet
+        """
+        return self._n_rows
+
+    def flush(self):
+        """
+        Writes all buffered rows to disk
+        """
+        if not self._n_rows:
+            return
+        self._write_batch()
+        self.n_written += self._n_rows
+        self._n_rows = 0
+        self._n_bytes = 0
+        if self.on_flush:
+            self.on_flush(self)
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._close()
+        self._closed = True
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:  # no checkpoints of a failed run
+            self.on_flush = None
+        self.close()
+
+    @abstractmethod
+    def _add(self, row: list) -> int:
+        """
+        Adds row to the buffer and returns its size in bytes
+        """
+
+    @abstractmethod
+    def _write_batch(self):
+        """
+        Writes the buffered rows to the file and empties the buffer
+        """
+
+    def _close(self):
+        pass
+
+
+class CSVSink(ResultSink):
+    """
+    Writes rows to a csv file. Rows are encoded when they are added, so the
+    buffer size in bytes is exact.
+    """
+
+    extension = ".csv"
+
+    def __init__(self, filepath: str, columns: List[str], **kwargs):
+        super().__init__(filepath, columns, **kwargs)
+        self._buffer = io.StringIO()
+        self._csv_writer = csv.writer(self._buffer)
+        if not (self.append and os.path.exists(filepath)):
+            with open(filepath, "w", newline="") as f:
+                csv.writer(f).writerow(columns)
+        self._file = open(filepath, "a", newline="")
+
+    def _add(self, row: list) -> int:
+        start = self._buffer.tell()
+        self._csv_writer.writerow(row)
+        return self._buffer.tell() - start
+
+    def _write_batch(self):
+        self._file.write(self._buffer.getvalue())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def _close(self):
+        self._file.close()
+
+
+class ArrowSink(ResultSink):
+    """
+    Writes rows to an Arrow IPC file. The schema is inferred from the first batch.
+    The size of a row in the buffer is estimated from the first row, and from
+    the size of the written batches after the first flush.
+    """
+
+    extension = ".arrow"
+
+    def __init__(self, filepath: str, columns: List[str], **kwargs):
+        import pyarrow
+
+        if kwargs.get("append"):
+            raise ValueError(f"{type(self).__name__} does not support appending")
+        super().__init__(filepath, columns, **kwargs)
+        self._pa = pyarrow
+        self._writer = None
+        self._rows = []
+        self._bytes_per_row = 0
+
+    def _add(self, row: list) -> int:
+        self._rows.append(row)
+        if not self._bytes_per_row:
+            self._bytes_per_row = max(
+                sum(len(v.encode()) if isinstance(v, str) else 8 for v in row), 1
+            )
+        return self._bytes_per_row
+
+    def _to_table(self, rows: List[list]):
+        arrays = [self._pa.array(list(col)) for col in zip(*rows)]
+        table = self._pa.Table.from_arrays(arrays, names=self.columns)
+        if self._writer is not None:
+            table = table.cast(self._writer.schema)
+        return table
+
+    def _open_writer(self, schema):
+        return self._pa.ipc.new_file(self.filepath, schema)
+
+    def _write_batch(self):
+        table = self._to_table(self._rows)
+        self._rows = []
+        if self._writer is None:
+            self._writer = self._open_writer(table.schema)
+        self._writer.write_table(table)
+        self._bytes_per_row = table.nbytes // max(table.num_rows, 1)
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class ParquetSink(ArrowSink):
+    """
+    Writes rows to a parquet file. Every flush becomes a row group.
+    """
+
+    extension = ".parquet"
+
+    def _open_writer(self, schema):
+        import pyarrow.parquet
+
+        return pyarrow.parquet.ParquetWriter(self.filepath, schema)
+
+
+SINKS = {"csv": CSVSink, "parquet": ParquetSink, "arrow": ArrowSink}
+
+
+def open_sink(
+    out_filepath: str, columns: List[str], backend: str = "csv", **kwargs
+) -> ResultSink:
+    """
+    Opens a result sink
+
+    Args:
+        out_filepath (str): output filepath without extension
+        columns (List[str]): header of the output
+        backend (str): either csv, parquet or arrow
+        **kwargs: passed on to the sink (max_rows, max_bytes, append, on_flush)
+
+    return
+        ResultSink
+    """
+    if backend not in SINKS:
+        raise ValueError(
+            f"Unknown backend {backend}. Must be one of {', '.join(SINKS)}."
+        )
+    sink = SINKS[backend]
+    return sink(f"{out_filepath}{sink.extension}", columns, **kwargs)
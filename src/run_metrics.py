@@ -0,0 +1,178 @@
+"""
+Structured metrics for the classification runs
+
+Metrics are written as json lines:
+- "progress" every report_every seconds: tweets/sec over a sliding window and
+  overall, time per stage (read, preprocess, cache, each model component, write)
+  since the last report, gauges (e.g. buffered rows), peak RSS and device memory
+- "summary" at the end of the run with the totals per stage
+"""
+import json
+import resource
+import sys
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+def peak_rss_mb() -> float:
+    """
+    returns the peak resident set size of the process in MB
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # bytes on mac, kilobytes on linux
+        return rss / 1024**2
+    return rss / 1024
+
+
+def device_memory_mb() -> float:
+    """
+    returns the peak memory allocated by torch on the gpu in MB (None without gpu)
+    """
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.max_memory_allocated() / 1024**2
+
+
+class RunMetrics:
+    """
+    Collects throughput and latency metrics and writes them as json lines
+
+    Args:
+        filepath (str): path of the json lines file. If None, metrics are collected but not written.
+        window_seconds (float): length of the sliding window for tweets/sec
+        report_every (float): seconds between progress records
+    """
+
+    def __init__(
+        self, filepath: str = None, window_seconds: float = 60, report_every: float = 30
+    ):
+        self.filepath = filepath
+        self.window_seconds = window_seconds
+        self.report_every = report_every
+        self.start_time = time.time()
+        self.n_tweets = 0
+        self.n_rows = 0
+        self.gauges = {}
+        self._totals = defaultdict(lambda: [0, 0.0])  # stage: [calls, seconds]
+        self._since_report = defaultdict(lambda: [0, 0.0, 0.0])  # + max seconds
+        self._window = deque()  # (time, n_tweets)
+        self._last_report = self.start_time
+        self._file = open(filepath, "a") if filepath else None
+
+    def _emit(self, record: dict):
+        if self._file:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def add_time(self, stage: str, seconds: float):
+        """
+        Records the time of one call of a stage (e.g. one batch)
+        """
+        total = self._totals[stage]
+        total[0] += 1
+        total[1] += seconds
+        recent = self._since_report[stage]
+        recent[0] += 1
+        recent[1] += seconds
+        recent[2] = max(recent[2], seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the code in the with block as one call of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def gauge(self, name: str, value):
+        """
+        Sets a gauge, e.g. a queue depth, reported with the next progress record
+        """
+        self.gauges[name] = value
+
+    def add_tweets(self, n_tweets: int, n_rows: int = 0):
+        """
+        Counts processed tweets (and written rows) and writes a progress record
+        if report_every seconds have passed
+        """
+        now = time.time()
+        self.n_tweets += n_tweets
+        self.n_rows += n_rows
+        self._window.append((now, self.n_tweets))
+        while self._window and self._window[0][0] < now - self.window_seconds:
+            self._window.popleft()
+        if now - self._last_report >= self.report_every:
+            self.report()
+
+    def _tweets_per_sec_window(self) -> float:
+        if len(self._window) < 2:
+            return None
+        (t0, n0), (t1, n1) = self._window[0], self._window[-1]
+        return (n1 - n0) / (t1 - t0) if t1 > t0 else None
+
+    def report(self):
+        """
+        Writes a progress record
+        """
+        now = time.time()
+        stages = {
+            stage: {
+                "calls": calls,
+                "seconds": seconds,
+                "mean_ms": 1000 * seconds / calls,
+                "max_ms": 1000 * max_seconds,
+            }
+            for stage, (calls, seconds, max_seconds) in self._since_report.items()
+        }
+        self._emit(
+            {
+                "event": "progress",
+                "time": now,
+                "elapsed": now - self.start_time,
+                "tweets": self.n_tweets,
+                "rows": self.n_rows,
+                "tweets_per_sec": self._tweets_per_sec_window(),
+                "tweets_per_sec_total": self.n_tweets / max(now - self.start_time, 1e-9),
+                "stages": stages,
+                "gauges": dict(self.gauges),
+                "peak_rss_mb": peak_rss_mb(),
+                "device_memory_mb": device_memory_mb(),
+            }
+        )
+        self._since_report.clear()
+        self._last_report = now
+
+    def summary(self) -> dict:
+        """
+        Writes (and returns) the summary of the run
+        """
+        elapsed = time.time() - self.start_time
+        record = {
+            "event": "summary",
+            "elapsed": elapsed,
+            "tweets": self.n_tweets,
+            "rows": self.n_rows,
+            "tweets_per_sec": self.n_tweets / max(elapsed, 1e-9),
+            "stages": {
+                stage: {
+                    "calls": calls,
+                    "seconds": seconds,
+                    "share": seconds / max(elapsed, 1e-9),
+                }
+                for stage, (calls, seconds) in self._totals.items()
+            },
+            "peak_rss_mb": peak_rss_mb(),
+            "device_memory_mb": device_memory_mb(),
+        }
+        self._emit(record)
+        return record
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
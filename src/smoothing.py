@@ -2,15 +2,65 @@
 Smoothing EmoDynamics signals
 '''
 
+import numpy as np
 import pandas as pd
 import os
-import sys
 import argparse
 
-#Code from newsFluxus Github. 
-path = os.path.join("newsFluxus", "src")
-sys.path.append(path)
-import news_uncertainty
+
+def normalize(x, lower:int=-1, upper:int=1) -> np.ndarray:
+    '''
+    returns x scaled to the range [lower, upper] (the middle of the range if x
+    is constant)
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    if np.max(x) == np.min(x):
+        return np.full(x.shape, (lower + upper) / 2)
+    return (upper - lower) * ((x - np.min(x)) / (np.max(x) - np.min(x))) + lower
+
+
+def detrend(y:np.ndarray, seg_len:int, fit_order:int=1) -> np.ndarray:
+    '''
+    Adaptive detrending (Gao et al.): fits a polynomial to segments of seg_len
+    points overlapping by half, and blends the fits of neighbouring segments
+    linearly in the overlaps, giving a smooth trend
+
+    returns the trend of y
+    '''
+    n_points = len(y)
+    step = (seg_len - 1) // 2
+    if seg_len > n_points or step < 1:
+        return y.copy()
+    starts = list(range(0, n_points - seg_len + 1, step))
+    if starts[-1] + seg_len < n_points:  # last segment aligned to the end
+        starts.append(n_points - seg_len)
+
+    x = np.arange(seg_len)
+    segments = y[np.array(starts)[:, None] + x]
+    coefs = np.polyfit(x, segments.T, fit_order)
+    fits = (np.vander(x, fit_order + 1) @ coefs).T
+
+    trend = np.empty(n_points)
+    trend[:seg_len] = fits[0]
+    for start, prev_start, fit in zip(starts[1:], starts, fits[1:]):
+        overlap = prev_start + seg_len - start
+        weight = np.arange(overlap) / (overlap - 1)
+        blend = slice(start, start + overlap)
+        trend[blend] = (1 - weight) * trend[blend] + weight * fit[:overlap]
+        trend[start + overlap:start + seg_len] = fit[overlap:]
+    return trend
+
+
+def adaptive_filter(y, span:int=56) -> np.ndarray:
+    '''
+    Smooths y (port of adaptive_filter of newsFluxus). The signal is
+    normalized to [-1, 1] and detrended with segments of 4 * (len(y) // span) + 1
+    points, so a larger span gives a smoother signal
+
+    returns the smoothed signal as an array
+    '''
+    seg_len = int(4 * np.floor(len(y) / span) + 1)
+    return detrend(normalize(y), seg_len, fit_order=1)
 
 
 def main(filename:str, span:int):
@@ -24,9 +74,9 @@ def main(filename:str, span:int):
     out_path = os.path.join("idmdl", "smoothed", f"{filename}_smoothed_{span}.csv")
 
     df = pd.read_csv(filepath)
-    df["smoothed_transience"] = news_uncertainty.adaptive_filter(df["transience"], span=span)
-    df["smoothed_novelty"] = news_uncertainty.adaptive_filter(df["novelty"], span=span)
-    df["smoothed_resonance"] = news_uncertainty.adaptive_filter(df["resonance"], span=span)
+    df["smoothed_transience"] = adaptive_filter(df["transience"], span=span)
+    df["smoothed_novelty"] = adaptive_filter(df["novelty"], span=span)
+    df["smoothed_resonance"] = adaptive_filter(df["resonance"], span=span)
     df.to_csv(out_path)
 
 
@@ -2,41 +2,123 @@
 For summarizing the BERT emotion probabilities
 """
 import argparse
+import functools
+import multiprocessing
 import pandas as pd
-import numpy as np
-import re
 import ndjson
+import json
 import time
 import os
+from glob import glob
 from typing import List
+from prob_columns import find_prob_columns, read_prob_matrix
+from group_stats import (
+    GroupMoments,
+    bin_start,
+    get_rollup,
+    group_key,
+    parse_bin_width,
+    time_bins,
+)
 
 
 ## Define functions ##
-def get_emotion_distribution(emo: str):
+def _csv_batches(
+    filepath: str,
+    usecols: List[str],
+    chunksize: int,
+    engine: str = "c",
+    only_emo: bool = False,
+    newlines_in_values: bool = False,
+):
     """
-    For transforming the BERT emotion distribution from a str to a list of floats
-    If there is no emotion distribution, it returns NaN
+    Yields chunks of the columns usecols of the csv. With only_emo, only
+    emotional laden tweets are kept, filtered chunk by chunk. The pyarrow
+    engine (requires pyarrow) parses blocks of the file in several threads.
+    newlines_in_values must be set for quoted values spanning several lines
+    (distributions stored as numpy strings), pyarrow then splits the file
+    into blocks more carefully.
     """
-    if not isinstance(emo, str):  # if emo == NaN
-        return emo
-    emo_list = re.split(r"\s+", emo[1:-1])
-    while "" in emo_list:  # often there is whitespace at the end
-        emo_list.pop()
-    if "nan" in emo_list:  # sometimes the topic model predict nan and inf
-        return [0 if emo == "nan" else 1 for emo in emo_list]
-    emo_list = list(map(lambda x: float(x), emo_list))
-    return emo_list
+    if engine == "pyarrow":
+        import pyarrow.compute as pc
+        from pyarrow import csv
+
+        reader = csv.open_csv(
+            filepath,
+            read_options=csv.ReadOptions(use_threads=True, block_size=64 * 1024**2),
+            parse_options=csv.ParseOptions(newlines_in_values=newlines_in_values),
+            convert_options=csv.ConvertOptions(include_columns=usecols),
+        )
+        for batch in reader:
+            if only_emo:
+                batch = batch.filter(pc.equal(batch["Bert_emo_laden"], "Emotional"))
+            yield batch.to_pandas()
+        return
+
+    for chunk in pd.read_csv(
+        filepath, header=0, usecols=usecols, chunksize=chunksize, engine=engine
+    ):
+        if only_emo:
+            chunk = chunk[
+                chunk["Bert_emo_laden"] == "Emotional"
+            ]  # only include emotional laden tweets
+        yield chunk
 
 
-def emotion_distribution_mean(emo_lists: list) -> list:
+def read_csv_chunks(
+    filepath: str,
+    time_col: str,
+    emo_col: str,
+    tweets=True,
+    only_emo=False,
+    chunksize: int = 100000,
+    bin_width: int = None,
+    timezone: str = None,
+    engine: str = "c",
+):
     """
-    Takes mean of each emotion probability in a BERT emotion probability list.
+    Reads the csv with emotion BERT scores in chunks. See read_in_csv. Only the
+    columns needed are parsed: time_col, the emotion probability columns and
+    Bert_emo_laden if only_emo.
+
+    yields
+        pandas.DataFrame with time_col, the emotion probability columns, and
+        date and hour (if tweets), or bin if bin_width
     """
-    return [(np.mean(prob), np.std(prob)) for prob in zip(*emo_lists)]
+    header = list(pd.read_csv(filepath, nrows=0).columns)
+    prob_cols = find_prob_columns(header, emo_col)
+    usecols = [time_col, *prob_cols] + (["Bert_emo_laden"] if only_emo else [])
+    # numpy strings of distributions wrap over several lines
+    as_strings = prob_cols == [emo_col]
+    batches = _csv_batches(filepath, usecols, chunksize, engine, only_emo, as_strings)
+    for i, chunk in enumerate(batches):
+        chunk = chunk[[time_col, *prob_cols]].copy()  # only include certain columns
+
+        created = pd.to_datetime(chunk[time_col], utc=True)
+        if bin_width:
+            # integer start of the time bin, see group_stats.time_bins
+            chunk["bin"] = time_bins(created, bin_width, timezone)
+        else:
+            # add date and hour
+            if timezone:
+                created = created.dt.tz_convert(timezone)
+            chunk["date"] = created.dt.strftime("%Y-%m-%d")
+            if tweets:
+                chunk["hour"] = created.dt.strftime("%H")
+        if i % 10 == 0:
+            print("at chunk ", i)
+        yield chunk
 
 
 def read_in_csv(
-    filepath: str, time_col: str, emo_col: str, tweets=True, only_emo=False
+    filepath: str,
+    time_col: str,
+    emo_col: str,
+    tweets=True,
+    only_emo=False,
+    bin_width: int = None,
+    timezone: str = None,
+    engine: str = "c",
 ):
     """
     Function for reading in the csv with emotion BERT scores
@@ -44,9 +126,16 @@ def read_in_csv(
     Args:
         filepath (str): path for the csv file
         time_col (str): column in df with time (e.g. 'created_at')
-        emo_col (str): column in df with the emotion probabilities
+        emo_col (str): column in df with the emotion probabilities (stored as
+            strings or as a column per class, see prob_columns.py)
         tweets (bool): True if tweets, False if newspapers
         only_emo (bool): whether only emotional tweets should be included
+        bin_width (int): if defined, a column bin with the start of the time
+            bin of bin_width seconds is added instead of date and hour
+        timezone (str): timezone of the dates, hours and bins (e.g.
+            Europe/Copenhagen). Default is UTC.
+        engine (str): csv parser, c (pandas) or pyarrow (multithreaded,
+            requires pyarrow)
 
     return
         pandas.DataFrame
@@ -54,82 +143,345 @@ def read_in_csv(
     start_time = time.time()
     ## load in data ##
     print("read data")
-    chunks = pd.read_csv(filepath, header=0, chunksize=1000)
+    df = pd.concat(
+        read_csv_chunks(
+            filepath,
+            time_col,
+            emo_col,
+            tweets,
+            only_emo,
+            bin_width=bin_width,
+            timezone=timezone,
+            engine=engine,
+        ),
+        ignore_index=True,
+    )
+    print("finished reading data. Time = ", time.time() - start_time)
+    return df
 
-    df = pd.DataFrame()
-    for i, chunk in enumerate(chunks):
-        if only_emo:
-            chunk = chunk[
-                chunk["Bert_emo_laden"] == "Emotional"
-            ]  # only include emotional laden tweets
-        chunk = chunk[[time_col, emo_col]]  # only include certain columns
 
-        df = pd.concat([df, chunk])
-        if i % 10 == 0:
-            print("at chunk ", i)
+def write_summary(records: List[dict], filename: str):
+    """
+    Writes the summary of each group to {filename}.ndjson
+    """
+    with open(f"{filename}.ndjson", "w") as f:
+        ndjson.dump(records, f)
+        f.write("\n")
 
-    print("finished reading data. Time = ", time.time() - start_time)
 
-    # add date and hour
-    df["date"] = pd.to_datetime(df[time_col], utc=True).dt.strftime("%Y-%m-%d")
-    if tweets:
-        df["hour"] = pd.to_datetime(df[time_col], utc=True).dt.strftime("%H")
-    return df
+def update_summary(moments: GroupMoments, filename: str):
+    """
+    Merges moments into the existing summary {filename}.ndjson (or creates it).
+    The summary is sorted by group, so only the lines from the first group in
+    moments onwards are read and rewritten. The file is replaced atomically.
+    """
+    path = f"{filename}.ndjson"
+    lines = []
+    if os.path.exists(path):
+        with open(path) as f:
+            lines = [line for line in f if line.strip()]
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
 
+    first = min(moments.stats)
+    split = len(lines)
+    while split > 0 and group_key(json.loads(lines[split - 1])["group"]) >= first:
+        split -= 1
+    tail = GroupMoments.from_records(
+        [json.loads(line) for line in lines[split:]], moments.group_by, moments.n_bins
+    )
+    tail.merge(moments)
 
-def write_ndjson_by_group(
-    df: pd.DataFrame, group_by: List[str], filename: str, emo_col: str
-):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(lines[:split])
+        ndjson.dump(tail.records(), f)
+        f.write("\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    print(f"updated {len(tail.stats)} groups of {path}")
+
+
+def read_ingested(path: str, levels: List[str]) -> dict:
+    """
+    returns the input files already summarized into the summary of each level
+    (a plain list of files applies to all levels)
     """
-    Groups df by arguments in group_by list.
-    Writes ndjson with group and emotion distribution
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        ingested = json.load(f)
+    if isinstance(ingested, list):
+        return {level: ingested for level in levels}
+    return ingested
 
-    Args
-        df (pandas.DataFrame): Dataframe with the data
-        group_by (List[str]): List of column to group by (e.g. date)
-        filename (str): Name of the file to be written
-        emo_col (str): Name of the column with the emotion distribution
 
-    return
-        None
-    """
-    grouped = df.groupby(group_by)
-    for name, group in grouped:
-        print("Group", name)
-        emo_lists = list(map(get_emotion_distribution, list(group[emo_col])))
-        emo_prob, emo_prob_sd = zip(*emotion_distribution_mean(emo_lists))
-        line = [
-            {
-                "group": name,
-                "emo_prob": emo_prob,
-                "emo_prob_sd": emo_prob_sd,
-                "n": len(group),
-            }
-        ]
-        with open(f"{filename}.ndjson", "a") as f:
-            ndjson.dump(line, f)
-            f.write("\n")
-
-
-def main(filepath: str, output_name: str, emo_col: str, time_col: str, only_emo: bool):
-    df = read_in_csv(filepath, time_col=time_col, emo_col=emo_col, only_emo=only_emo)
-
-    # write ndjson
-    write_ndjson_by_group(
-        df,
-        group_by=["date", "hour"],
-        filename=os.path.join("summarized_emo", f"{output_name}_date_hour"),
+def write_ingested(ingested: dict, path: str):
+    """
+    Writes the input files summarized into each level, replacing path atomically
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(ingested, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def check_quantile_bins(filename: str, n_bins: int):
+    """
+    Raises ValueError if the existing summary {filename}.ndjson has histograms
+    with another number of bins than n_bins (or has none while n_bins is given),
+    so new statistics can be merged into all of its groups
+    """
+    path = f"{filename}.ndjson"
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        line = f.readline()
+    if not line.strip():
+        return
+    existing = json.loads(line).get("emo_prob_hist_bins")
+    if existing != n_bins:
+        raise ValueError(
+            f"{path} has histograms with {existing} bins, update it with quantile_bins={existing}"
+        )
+
+
+def summarize_streaming(
+    filepath: str,
+    emo_col: str,
+    time_col: str,
+    only_emo: bool,
+    group_bys: List[List[str]],
+    chunksize: int = 100000,
+    n_bins: int = None,
+    bin_width: int = None,
+    timezone: str = None,
+    engine: str = "c",
+) -> List[GroupMoments]:
+    """
+    Aggregates the csv chunk by chunk into running statistics per group for
+    each grouping in group_bys, without holding the rows in memory. If n_bins,
+    histograms for quantiles are computed in the same pass.
+
+    returns
+        list of GroupMoments, one for each grouping
+    """
+    moments = [GroupMoments(group_by, n_bins) for group_by in group_bys]
+    for chunk in read_csv_chunks(
+        filepath,
+        time_col,
+        emo_col,
+        only_emo=only_emo,
+        chunksize=chunksize,
+        bin_width=bin_width,
+        timezone=timezone,
+        engine=engine,
+    ):
+        probs = read_prob_matrix(chunk, emo_col)
+        for group_moments in moments:
+            group_moments.update(chunk, probs)
+    return moments
+
+
+def summarize_file(
+    filepath: str,
+    emo_col: str,
+    time_col: str,
+    only_emo: bool,
+    streaming: bool,
+    n_bins: int = None,
+    bin_width: int = None,
+    timezone: str = None,
+    engine: str = "c",
+) -> GroupMoments:
+    """
+    returns the statistics of the csv filepath by date and hour, or by time
+    bin if bin_width
+    """
+    group_by = ["bin"] if bin_width else ["date", "hour"]
+    if streaming:
+        (moments,) = summarize_streaming(
+            filepath,
+            emo_col,
+            time_col,
+            only_emo,
+            [group_by],
+            n_bins=n_bins,
+            bin_width=bin_width,
+            timezone=timezone,
+            engine=engine,
+        )
+        return moments
+    df = read_in_csv(
+        filepath,
+        time_col=time_col,
         emo_col=emo_col,
+        only_emo=only_emo,
+        bin_width=bin_width,
+        timezone=timezone,
+        engine=engine,
     )
-    print("finished grouped by date and hour")
+    moments = GroupMoments(group_by, n_bins)
+    moments.update(df, read_prob_matrix(df, emo_col))
+    return moments
+
 
-    write_ndjson_by_group(
-        df,
-        group_by=["date"],
-        filename=os.path.join("summarized_emo", f"{output_name}_date"),
+def summarize_files(
+    filepaths: List[str],
+    emo_col: str,
+    time_col: str,
+    only_emo: bool,
+    streaming: bool,
+    n_workers: int = 1,
+    n_bins: int = None,
+    bin_width: int = None,
+    timezone: str = None,
+    engine: str = "c",
+) -> GroupMoments:
+    """
+    Summarizes each file (shard) by date and hour (or time bin, see
+    summarize_file), in n_workers processes, and
+    merges the statistics of the shards. The shards are merged in the order of
+    filepaths, so the result does not depend on the number of workers.
+    """
+    summarize = functools.partial(
+        summarize_file,
         emo_col=emo_col,
+        time_col=time_col,
+        only_emo=only_emo,
+        streaming=streaming,
+        n_bins=n_bins,
+        bin_width=bin_width,
+        timezone=timezone,
+        engine=engine,
     )
-    print("finished grouped by date")
+    moments = GroupMoments(["bin"] if bin_width else ["date", "hour"], n_bins)
+    if n_workers > 1:
+        with multiprocessing.Pool(n_workers) as pool:
+            for shard in pool.imap(summarize, filepaths):
+                moments.merge(shard)
+    else:
+        for filepath in filepaths:
+            moments.merge(summarize(filepath))
+    return moments
+
+
+def main(
+    filepath: str,
+    output_name: str,
+    emo_col: str,
+    time_col: str,
+    only_emo: bool,
+    streaming: bool = False,
+    levels: List[str] = None,
+    update: bool = False,
+    n_workers: int = 1,
+    quantile_bins: int = None,
+    bins: List[str] = None,
+    timezone: str = None,
+    engine: str = "c",
+):
+    """
+    Summarizes the emotion probabilities by date and hour, and rolls the
+    summary up into each of the levels (date_hour, date, week, month or a
+    strftime format of the date, see group_stats.get_rollup; default date_hour
+    and date). Writes summarized_emo/{output_name}_{level}.ndjson
+
+    filepath can be a glob matching several csv shards, which are summarized
+    in n_workers processes.
+
+    With bins (bin widths such as 15min, 6h, 1d, 1w), the tweets are grouped
+    into time bins instead, keyed by the integer start of the bin (seconds
+    since 1970-01-01 on the local clock, see group_stats.time_bins). The
+    summary of the narrowest bin is rolled up into the wider bins, which must
+    be multiples of it. Writes summarized_emo/{output_name}_{bin}.ndjson. Dates,
+    hours and bins follow timezone (default UTC).
+
+    If quantile_bins, a histogram with quantile_bins bins is kept per group and
+    class, and the summaries include the quantiles of each class.
+
+    With update, filepath only holds new tweets, whose statistics are merged
+    into the existing summaries. The files summarized into each level are
+    listed in summarized_emo/{output_name}.ingested.json, updated after each
+    level, so a file is never added twice to a level (also when a previous
+    update stopped halfway).
+    """
+    filepaths = [os.path.abspath(path) for path in sorted(glob(filepath))]
+    if not filepaths:
+        raise FileNotFoundError(f"No files match {filepath}")
+
+    if levels is None:
+        levels = ["date_hour", "date"]
+    widths, finest = {}, None
+    if bins:
+        widths = {name: parse_bin_width(name) for name in bins}
+        levels = sorted(widths, key=widths.get)
+        finest = widths[levels[0]]
+        for name, width in widths.items():
+            if width % finest:
+                raise ValueError(f"Bin width {name} is not a multiple of {levels[0]}")
+    else:
+        for level in levels:
+            if level != "date_hour":
+                get_rollup(level)  # unknown levels fail before summarizing
+
+    def level_filename(level: str) -> str:
+        # strftime formats are not valid in file names
+        name = level.replace("%", "").replace("/", "-")
+        return os.path.join("summarized_emo", f"{output_name}_{name}")
+
+    ingested_path = os.path.join("summarized_emo", f"{output_name}.ingested.json")
+    ingested = read_ingested(ingested_path, levels) if update else {}
+    todo = {
+        level: [path for path in filepaths if path not in ingested.get(level, [])]
+        for level in levels
+    }
+    if not any(todo.values()):
+        print(f"{filepath} is already summarized according to {ingested_path}")
+        return
+    if update:
+        for level in levels:
+            check_quantile_bins(level_filename(level), quantile_bins)
+
+    # levels missing the same files share one summary (normally all levels)
+    for files in {tuple(files): None for files in todo.values() if files}:
+        start_time = time.time()
+        summary = summarize_files(
+            list(files),
+            emo_col,
+            time_col,
+            only_emo,
+            streaming,
+            n_workers,
+            quantile_bins,
+            bin_width=finest,
+            timezone=timezone,
+            engine=engine,
+        )
+        print("finished summarizing. Time = ", time.time() - start_time)
+
+        for level in [level for level in levels if tuple(todo[level]) == files]:
+            if level in widths and widths[level] > finest:
+                moments = summary.rollup(
+                    lambda key, width=widths[level]: (bin_start(key[0], width),),
+                    ["bin"],
+                )
+            elif level in widths or level == "date_hour":
+                moments = summary
+            else:
+                moments = summary.rollup(get_rollup(level), [level])
+            filename = level_filename(level)
+            if update:
+                if moments.stats:
+                    update_summary(moments, filename)
+            else:
+                write_summary(moments.records(), filename)
+            ingested[level] = ingested.get(level, []) + list(files)
+            write_ingested(ingested, ingested_path)
+            print(f"finished grouped by {level}")
 
 
 if __name__ == "__main__":
@@ -138,7 +490,7 @@ if __name__ == "__main__":
         "--filepath",
         type=str,
         required=True,
-        help="Path for the file containing the emotion scores",
+        help="Path for the file containing the emotion scores, or a glob matching several csv shards",
     )
     parser.add_argument(
         "--output_name", type=str, required=True, help="Name of the output file"
@@ -162,6 +514,61 @@ if __name__ == "__main__":
         default=False,
         help="whether only emotional tweets should be included",
     )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Aggregate the csv chunk by chunk into running statistics per group instead of reading it into memory",
+    )
+    parser.add_argument(
+        "--levels",
+        type=str,
+        required=False,
+        nargs="+",
+        default=["date_hour", "date"],
+        help="Time resolutions to summarize by: date_hour, date, week, month or a strftime format of the date made of %%Y, %%m and %%d (e.g. %%Y). Coarser levels are merged from the date and hour summary. Default is date_hour date.",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="filepath only holds new tweets, merge them into the existing summaries instead of rewriting them",
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of processes summarizing the shards matched by filepath. Default is 1.",
+    )
+    parser.add_argument(
+        "--quantile_bins",
+        type=int,
+        required=False,
+        default=None,
+        help="If defined, keeps a histogram with this many bins per group and class and adds quantiles to the summaries (e.g. 100).",
+    )
+    parser.add_argument(
+        "--bins",
+        type=str,
+        required=False,
+        nargs="+",
+        default=None,
+        help="If defined, groups by time bins of these widths (e.g. 15min 6h 1d 1w) with integer keys instead of the levels.",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        required=False,
+        default="c",
+        choices=["c", "pyarrow"],
+        help="Parser for the csv. pyarrow parses in several threads (requires pyarrow). Default is c.",
+    )
+    parser.add_argument(
+        "--timezone",
+        type=str,
+        required=False,
+        default=None,
+        help="Timezone of the dates, hours and bins, e.g. Europe/Copenhagen. Default is UTC.",
+    )
     args = parser.parse_args()
 
     print(
@@ -170,7 +577,15 @@ if __name__ == "__main__":
              output_name={args.output_name},
              emo_col={args.emotion_col},
              time_col={args.time_col},
-             only_emo={args.only_emo}"""
+             only_emo={args.only_emo},
+             streaming={args.streaming},
+             levels={args.levels},
+             update={args.update},
+             n_workers={args.n_workers},
+             quantile_bins={args.quantile_bins},
+             bins={args.bins},
+             timezone={args.timezone},
+             engine={args.engine}"""
     )
     main(
         filepath=args.filepath,
@@ -178,4 +593,12 @@ if __name__ == "__main__":
         emo_col=args.emotion_col,
         time_col=args.time_col,
         only_emo=args.only_emo,
+        streaming=args.streaming,
+        levels=args.levels,
+        update=args.update,
+        n_workers=args.n_workers,
+        quantile_bins=args.quantile_bins,
+        bins=args.bins,
+        timezone=args.timezone,
+        engine=args.engine,
     )
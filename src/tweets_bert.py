@@ -14,49 +14,114 @@ Model for english tweets:
 
 ### Load modules ###
 import argparse
-import ndjson
+import csv
+import functools
+import itertools
+import json
+import multiprocessing
+import os
 from glob import glob
-import re
-import pandas as pd
 import preprocess
 import spacy
 from spacy.tokens import Doc
 import time
-from csv import writer
-
-spacy.require_gpu()
+import numpy as np
+from result_sink import open_sink, SINKS
+from checkpoint import Checkpoint, restore_output
+from cpu_inference import quantize_pipeline, compare_outputs, weights_fingerprint
+from classifier_cache import ClassifierCache
+from ndjson_reader import ndjson_gen, read_ndjson_file, is_compressed
+from prob_columns import expand_columns
+from run_metrics import RunMetrics
+
+# fields of the posts used for the output
+FIELDS = ["text", "created_at", "id"]
+
+# probability distributions in the output and their number of classes,
+# each class probability is written as its own float32 column
+PROB_COLUMNS = {
+    "da": {"Bert_emo_emotion_prob": 8, "polarity_prob": 3},
+    "en": {"emotion_prob": 6},
+}
+
+# huggingface model of the english pipeline
+EN_MODEL = "bhadresh-savani/distilbert-base-uncased-emotion"
+
+# packages providing the models (and their weights), part of the cache keys
+MODEL_PACKAGES = {
+    "da": ["dacy", "danlp", "spacy", "spacy-transformers", "transformers", "torch"],
+    "en": ["spacy-wrap", "spacy", "transformers", "torch"],
+}
 
 ## define functions ##
-def append_list_as_row(file_name, list_of_elem):
-    # Open file in append mode
-    with open(file_name, "a+", newline="") as write_obj:
-        # Create a writer object from csv module
-        csv_writer = writer(write_obj)
-        # Add contents of list as last row in the csv file
-        csv_writer.writerow(list_of_elem)
-
-
-def ndjson_gen(filepath: str):
-    for in_file in glob(filepath):
-        with open(in_file) as f:
-            reader = ndjson.reader(f)
-
-            for post in reader:
-                yield post
+def setup_device(device: str, n_threads: int = None):
+    """
+    Runs the models on gpu or cpu. n_threads sets the number of torch threads.
+    """
+    if device == "gpu":
+        spacy.require_gpu()
+    else:
+        spacy.require_cpu()
+    if n_threads:
+        import torch
+
+        torch.set_num_threads(n_threads)
+
+
+def doc_to_outputs(doc: Doc, language: str) -> list:
+    """
+    returns the model outputs for a classified tweet (the output row without
+    index, created_at and id)
+    """
+    if language == "da":
+        # Sentiment
+        d = doc._.vader_da
+
+        # Bert subjectivity
+        subj_label = doc._.subjectivity
+        subj_prob = doc._.subjectivity_prop["prop"]
+
+        # Bert emotion
+        laden = doc._.laden
+        emo = doc._.emotion
+        laden_prob = doc._.laden_prop
+        emo_prob = doc._.emotion_prop
+
+        # polarity
+        pol_label = doc._.polarity
+        pol_label_prob = doc._.polarity_prop["prop"]
+
+        # creating row
+        outputs = [
+            d["compound"],
+            d["neu"],
+            d["neg"],
+            d["pos"],
+            subj_label,
+            max(subj_prob),
+            laden,
+            max(laden_prob["prop"]),
+            emo,
+            *np.asarray(emo_prob["prop"], dtype=np.float32),
+            pol_label,
+            *np.asarray(pol_label_prob, dtype=np.float32),
+        ]
 
+    if language == "en":
+        # emotion
+        emo = doc._.emotion
+        emo_prob = doc._.emotion_prob["prob"]
 
-def gen_to_tuple_gen(generator, field="text"):
-    for post in generator:
-        if not post:  # remove empty posts
-            continue
-        if re.search("^RT", post[field]):  # remove retweets
-            continue
-        post[field] = preprocess.clean_tweets(post[field])
-        yield post[field], post
+        # creating row
+        outputs = [emo, *np.asarray(emo_prob, dtype=np.float32)]
+    return outputs
 
 
-def main(in_filepath: str, out_filepath: str, language: str):
-    ## All models ##
+def load_nlp(language: str, quantize: bool = False):
+    """
+    Loads the spacy pipeline with the classification models for language.
+    If quantize, the transformer models are dynamically quantized to int8 (cpu only).
+    """
     print("Prepare models")
     if language == "da":
         import ssl
@@ -87,97 +152,554 @@ def main(in_filepath: str, out_filepath: str, language: str):
             "doc_extension_prediction": "emotion",
             "labels": ["sadness", "joy", "love", "anger", "fear", "surprise"],
             "model": {
-                "name": "bhadresh-savani/distilbert-base-uncased-emotion",  # the model name or path of huggingface model
+                "name": EN_MODEL,  # the model name or path of huggingface model
             },
         }
         nlp.add_pipe("classification_transformer", config=config)
 
-    ### Creating out csv ###
+    if quantize:
+        n_quantized = quantize_pipeline(nlp)
+        print(f"Quantized {n_quantized} models to int8")
+    return nlp
+
+
+def package_versions(packages: list) -> str:
+    """
+    returns the installed versions of the packages as package=version
+    """
+    from importlib import metadata
+
+    versions = []
+    for package in packages:
+        try:
+            versions.append(f"{package}={metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{package}=none")
+    return ",".join(versions)
+
+
+def model_version(nlp, language: str, quantize: bool) -> str:
+    """
+    returns string identifying the models, used as part of the cache keys:
+    the pipeline, precision, versions of the packages providing the models,
+    the huggingface model (en) and a fingerprint of the weights
+    """
+    precision = "int8" if quantize else "fp32"
+    packages = package_versions(MODEL_PACKAGES[language])
+    model = f":{EN_MODEL}" if language == "en" else ""
+    return (
+        f"{language}:{','.join(nlp.pipe_names)}:{precision}:prob_columns"
+        f":{packages}{model}:{weights_fingerprint(nlp)}"
+    )
+
+
+def get_columns(language: str) -> list:
+    """
+    returns the header of the output file for language
+    """
     if language == "da":
-        out = pd.DataFrame(
-            columns=[
-                "created_at",
-                "id",
-                "Sentiment_compound",
-                "Sentiment_neutral",
-                "Sentiment_negative",
-                "Sentiment_positive",
-                "Bert_subj_label",
-                "Bert_subj_prob",
-                "Bert_emo_laden",
-                "Bert_emo_laden_prob",
-                "Bert_emo_emotion",
-                "Bert_emo_emotion_prob",
-                "polarity",
-                "polarity_prob",
-            ]
-        )
+        columns = [
+            "",
+            "created_at",
+            "id",
+            "Sentiment_compound",
+            "Sentiment_neutral",
+            "Sentiment_negative",
+            "Sentiment_positive",
+            "Bert_subj_label",
+            "Bert_subj_prob",
+            "Bert_emo_laden",
+            "Bert_emo_laden_prob",
+            "Bert_emo_emotion",
+            "Bert_emo_emotion_prob",
+            "polarity",
+            "polarity_prob",
+        ]
     if language == "en":
-        out = pd.DataFrame(
-            columns=["created_at", "id", "emotion_label", "emotion_prob"]
+        columns = ["", "created_at", "id", "emotion_label", "emotion_prob"]
+    return expand_columns(columns, PROB_COLUMNS[language])
+
+
+def run_models(
+    nlp,
+    texts: list,
+    language: str,
+    batch_size: int = 1024,
+    bucket: bool = True,
+    cache: ClassifierCache = None,
+    metrics: RunMetrics = None,
+) -> list:
+    """
+    Runs the models on a window of texts and returns their outputs in the same
+    order (None for empty docs).
+
+    Each distinct text is only run once. If bucket, the texts are sorted by
+    length before batching, so tweets of similar length end up in the same
+    batch and less compute is spent on padding. If a cache is given, only texts
+    not in the cache are run through the models and their outputs are added to
+    the cache.
+
+    The pipeline components are run batch by batch (as nlp.pipe does), so the
+    time of each component is recorded in metrics.
+    """
+    metrics = metrics or RunMetrics()
+    with metrics.stage("cache"):
+        cached = cache.get_many(texts) if cache else {}
+    distinct = list(
+        dict.fromkeys(text for i, text in enumerate(texts) if i not in cached)
+    )
+    if bucket:
+        distinct.sort(key=len)
+    new = {}
+    for start in range(0, len(distinct), batch_size):
+        batch = distinct[start : start + batch_size]
+        with metrics.stage("tokenize"):
+            docs = [nlp.make_doc(text) for text in batch]
+        for name, proc in nlp.pipeline:
+            with metrics.stage(f"model:{name}"):
+                if hasattr(proc, "pipe"):
+                    docs = list(proc.pipe(docs, batch_size=batch_size))
+                else:
+                    docs = [proc(doc) for doc in docs]
+        # None if doc is an empty string
+        for text, doc in zip(batch, docs):
+            new[text] = doc_to_outputs(doc, language) if doc else None
+    if cache and new:
+        with metrics.stage("cache"):
+            cache.put_many(list(new), list(new.values()))
+    return [cached[i] if i in cached else new[text] for i, text in enumerate(texts)]
+
+
+def classify(
+    nlp,
+    posts,
+    language: str,
+    start_index: int = 0,
+    batch_size: int = 1024,
+    bucket_batches: int = 16,
+    cache: ClassifierCache = None,
+    metrics: RunMetrics = None,
+):
+    """
+    Runs the models on the posts and yields the output rows together with the
+    position of the post in the input. Every post that is not a retweet gets an
+    index (also when it is empty after cleaning and has no row), the generator
+    returns the index after the last post.
+
+    The tweets are processed in windows of bucket_batches batches, within which
+    they are batched by length if bucket_batches > 1 (see run_models).
+    """
+    metrics = metrics or RunMetrics()
+    posts = iter(posts)  # windows are sliced off, so a list must not restart
+    window_size = batch_size * max(bucket_batches, 1)
+    index = start_index
+    while True:
+        with metrics.stage("read"):
+            window = list(itertools.islice(posts, window_size))
+        if not window:
+            return index
+        with metrics.stage("preprocess"):
+            cleaned, is_retweet, is_empty = preprocess.clean_tweets_batch(
+                [post["text"] for post in window]
+            )
+        # retweets and tweets that are empty after cleaning never reach the models
+        keep = [i for i in range(len(window)) if not (is_retweet[i] or is_empty[i])]
+        outputs = run_models(
+            nlp,
+            [cleaned[i] for i in keep],
+            language,
+            batch_size,
+            bucket_batches > 1,
+            cache,
+            metrics,
+        )
+        outputs = dict(zip(keep, outputs))
+        n_rows = sum(out is not None for out in outputs.values())
+        metrics.add_tweets(len(window), n_rows)
+        for i, post in enumerate(window):
+            if is_retweet[i]:  # remove retweets
+                continue
+            output = outputs.get(i)
+            if output is not None:
+                row = [index, post["created_at"], post["id"], *output]
+                yield row, post["_position"]
+            index += 1
+
+
+def main(
+    in_filepath: str,
+    out_filepath: str,
+    language: str,
+    backend: str = "csv",
+    flush_rows: int = 100000,
+    resume: bool = False,
+    device: str = "gpu",
+    quantize: bool = False,
+    n_threads: int = None,
+    batch_size: int = 1024,
+    bucket_batches: int = 16,
+    cache_path: str = None,
+    metrics_path: str = None,
+):
+    out_path = f"{out_filepath}{SINKS[backend].extension}"
+    checkpoint = Checkpoint(f"{out_filepath}.checkpoint.json")
+    state = checkpoint.load() if resume else None
+    if resume and backend != "csv":
+        raise ValueError("Resuming is only supported for the csv backend")
+    if state and state["finished"]:
+        print(f"All tweets are already classified according to {checkpoint.filepath}")
+        return
+
+    setup_device(device, n_threads)
+    nlp = load_nlp(language, quantize)
+    columns = get_columns(language)
+    cache = None
+    if cache_path:
+        cache = ClassifierCache(cache_path, model_version(nlp, language, quantize))
+
+    # progress of the rows on disk, from the checkpoint when resuming
+    progress = {"position": None, "index": 0}
+    if state:
+        restore_output(state, out_path)
+        progress = {
+            "position": (state["in_file"], state["offset"]),
+            "index": state["index"],
+        }
+        print(
+            f"Resuming from {state['in_file']} at byte {state['offset']} (row {state['index']})"
         )
-    out.to_csv(f"{out_filepath}.csv")
 
-    gen = ndjson_gen(in_filepath)
-    tuple_gen = gen_to_tuple_gen(gen)
-    docs = nlp.pipe(tuple_gen, as_tuples=True, batch_size=1024)
+    def commit(sink):
+        position, index = sink.progress
+        checkpoint.commit(position, index, sink.filepath)
+
+    sink = open_sink(
+        out_filepath,
+        columns,
+        backend=backend,
+        max_rows=flush_rows,
+        append=state is not None,
+        on_flush=commit,
+    )
+
+    if state:
+        gen = ndjson_gen(
+            in_filepath,
+            FIELDS,
+            start_file=state["in_file"],
+            start_offset=state["offset"],
+        )
+    else:
+        gen = ndjson_gen(in_filepath, FIELDS)
 
+    metrics = RunMetrics(metrics_path)
     model_time = time.time()
-    for index, (doc, context) in enumerate(docs):
-        if not doc:  # if doc is an empty string
-            continue
-
-        if language == "da":
-            # Sentiment
-            d = doc._.vader_da
-
-            # Bert subjectivity
-            subj_label = doc._.subjectivity
-            subj_prob = doc._.subjectivity_prop["prop"]
-
-            # Bert emotion
-            laden = doc._.laden
-            emo = doc._.emotion
-            laden_prob = doc._.laden_prop
-            emo_prob = doc._.emotion_prop
-
-            # polarity
-            pol_label = doc._.polarity
-            pol_label_prob = doc._.polarity_prop["prop"]
-
-            # creating row
-            row = [
-                index,
-                context["created_at"],
-                context["id"],
-                d["compound"],
-                d["neu"],
-                d["neg"],
-                d["pos"],
-                subj_label,
-                max(subj_prob),
-                laden,
-                max(laden_prob["prop"]),
-                emo,
-                emo_prob["prop"],
-                pol_label,
-                pol_label_prob,
-            ]
-
-        if language == "en":
-            # emotion
-            emo = doc._.emotion
-            emo_prob = doc._.emotion_prob["prob"]
-
-            # creating row
-            row = [index, context["created_at"], context["id"], emo, emo_prob]
-
-        append_list_as_row(f"{out_filepath}.csv", row)
-        mid_time = time.time()
-        if index % 10000 == 0:
+    with sink:
+        for row, position in classify(
+            nlp,
+            gen,
+            language,
+            progress["index"],
+            batch_size,
+            bucket_batches,
+            cache,
+            metrics,
+        ):
+            index = row[0]
+            with metrics.stage("write"):
+                sink.write(row, progress=(position, index + 1))
+            metrics.gauge("sink_buffered_rows", sink.n_buffered)
+            mid_time = time.time()
+            if index % 10000 == 0:
+                print(
+                    f"Running model on row number {index} now finished - time in min: {(mid_time - model_time)/60}"
+                )
+    if sink.progress:
+        progress["position"], progress["index"] = sink.progress
+    if progress["position"]:
+        checkpoint.commit(
+            progress["position"], progress["index"], out_path, finished=True
+        )
+    if cache:
+        print(f"Cache statistics: {cache.stats()}")
+        metrics.gauge("cache", cache.stats())
+        cache.close()
+    metrics.report()
+    metrics.summary()
+    metrics.close()
+
+
+## sharded classification ##
+# model of the worker process, set by init_worker
+_worker = {}
+
+
+def split_file(in_file: str, chunk_bytes: int) -> list:
+    """
+    Splits in_file into byte ranges of about chunk_bytes that start at the
+    beginning of a line
+    """
+    size = os.path.getsize(in_file)
+    bounds = [0]
+    with open(in_file, "rb") as f:
+        while bounds[-1] + chunk_bytes < size:
+            f.seek(bounds[-1] + chunk_bytes)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def make_tasks(filepath: str, chunk_bytes: int = None) -> list:
+    """
+    returns list of tasks (task_id, in_file, start, end). Each input file is one
+    task, or is split into byte ranges of about chunk_bytes if given (only
+    uncompressed files).
+    """
+    tasks = []
+    for in_file in sorted(glob(filepath)):
+        if chunk_bytes and not is_compressed(in_file):
+            ranges = split_file(in_file, chunk_bytes)
+        else:
+            ranges = [(0, None)]
+        for start, end in ranges:
+            tasks.append((len(tasks), in_file, start, end))
+    return tasks
+
+
+def part_path(parts_dir: str, task_id: int) -> str:
+    return os.path.join(parts_dir, f"part_{task_id:05d}.csv")
+
+
+def count_path(parts_dir: str, task_id: int) -> str:
+    """
+    path of the file with the number of indexed tweets of the task
+    """
+    return os.path.join(parts_dir, f"part_{task_id:05d}.count")
+
+
+def init_worker(
+    language: str,
+    n_threads: int,
+    device: str,
+    quantize: bool,
+    batch_size: int,
+    bucket_batches: int,
+    cache_path: str,
+    version: str,
+    metrics_path: str = None,
+):
+    """
+    Loads the models in a worker process with a budget of n_threads torch threads.
+    version is the model version of the cache keys (see model_version), computed
+    once in the parent process. Each worker writes its metrics to its own file,
+    {metrics_path}.worker{pid}
+    """
+    setup_device(device, n_threads)
+    _worker["language"] = language
+    _worker["nlp"] = load_nlp(language, quantize)
+    _worker["batch_size"] = batch_size
+    _worker["bucket_batches"] = bucket_batches
+    _worker["cache"] = None
+    if cache_path:
+        _worker["cache"] = ClassifierCache(cache_path, version)
+    if metrics_path:
+        metrics_path = f"{metrics_path}.worker{os.getpid()}"
+    _worker["metrics"] = RunMetrics(metrics_path)
+
+
+def classify_task(task: tuple, parts_dir: str):
+    """
+    Classifies the tweets of one task and writes them to the part file of the task,
+    indexed from 0, and the number of indexed tweets to its count file.
+    The part file is only created when the task has finished.
+    returns task_id, number of rows, time and the cache hits and misses of the task
+    """
+    task_id, in_file, start, end = task
+    language = _worker["language"]
+    cache = _worker["cache"]
+    metrics = _worker["metrics"]
+    hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+    start_time = time.time()
+    tmp_path = os.path.join(parts_dir, f"tmp_{task_id:05d}")
+    posts = read_ndjson_file(in_file, FIELDS, start=start, end=end)
+    rows = classify(
+        _worker["nlp"],
+        posts,
+        language,
+        batch_size=_worker["batch_size"],
+        bucket_batches=_worker["bucket_batches"],
+        cache=cache,
+        metrics=metrics,
+    )
+    with open_sink(tmp_path, get_columns(language)) as sink:
+        while True:
+            try:
+                row, _ = next(rows)
+            except StopIteration as stop:
+                n_indexed = stop.value
+                break
+            with metrics.stage("write"):
+                sink.write(row)
+    metrics.gauge("task", task_id)
+    metrics.report()
+    with open(count_path(parts_dir, task_id), "w") as f:
+        f.write(str(n_indexed))
+    os.replace(sink.filepath, part_path(parts_dir, task_id))
+    if cache:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return task_id, sink.n_written, time.time() - start_time, hits, misses
+
+
+def merge_parts(part_paths: list, out_path: str, columns: list, counts: list) -> int:
+    """
+    Concatenates the part files in the given order into out_path. The index of
+    each part is offset by the number of indexed tweets (counts) of the parts
+    before it, giving the same index as the single process classification.
+    returns the number of rows
+    """
+    n_rows = 0
+    offset = 0
+    with open(out_path, "w", newline="") as out:
+        csv_writer = csv.writer(out)
+        csv_writer.writerow(columns)
+        for path, count in zip(part_paths, counts):
+            with open(path, newline="") as f:
+                reader = csv.reader(f)
+                next(reader)  # header
+                for row in reader:
+                    row[0] = offset + int(row[0])
+                    csv_writer.writerow(row)
+                    n_rows += 1
+            offset += count
+    return n_rows
+
+
+def main_sharded(
+    in_filepath: str,
+    out_filepath: str,
+    language: str,
+    n_workers: int,
+    n_threads: int = None,
+    chunk_mb: int = None,
+    resume: bool = False,
+    device: str = "gpu",
+    quantize: bool = False,
+    batch_size: int = 1024,
+    bucket_batches: int = 16,
+    cache_path: str = None,
+    metrics_path: str = None,
+):
+    """
+    Classifies the input files (or byte ranges of them) in n_workers processes,
+    each with its own models. The part files are merged in input order, so the
+    output does not depend on the number of workers. With resume, finished
+    parts of a previous run are kept.
+    """
+    parts_dir = f"{out_filepath}_parts"
+    tasks_path = os.path.join(parts_dir, "tasks.json")
+    os.makedirs(parts_dir, exist_ok=True)
+    if resume and os.path.exists(tasks_path):
+        with open(tasks_path) as f:
+            tasks = [tuple(task) for task in json.load(f)]
+    else:
+        for path in glob(os.path.join(parts_dir, "*.csv")):
+            os.remove(path)
+        for path in glob(os.path.join(parts_dir, "*.count")):
+            os.remove(path)
+        chunk_bytes = chunk_mb * 1024**2 if chunk_mb else None
+        tasks = make_tasks(in_filepath, chunk_bytes)
+        with open(tasks_path, "w") as f:
+            json.dump(tasks, f)
+
+    todo = [
+        task
+        for task in tasks
+        if not (
+            os.path.exists(part_path(parts_dir, task[0]))
+            and os.path.exists(count_path(parts_dir, task[0]))
+        )
+    ]
+    if n_threads is None:
+        n_threads = max(1, os.cpu_count() // n_workers)
+    print(
+        f"{len(todo)} of {len(tasks)} tasks left, running {n_workers} workers with {n_threads} threads each"
+    )
+
+    version = None
+    if cache_path:
+        # the weights are hashed once here instead of in every worker
+        version = model_version(load_nlp(language, quantize), language, quantize)
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(
+        n_workers,
+        initializer=init_worker,
+        initargs=(
+            language,
+            n_threads,
+            device,
+            quantize,
+            batch_size,
+            bucket_batches,
+            cache_path,
+            version,
+            metrics_path,
+        ),
+    ) as pool:
+        metrics = RunMetrics(metrics_path)
+        metrics.gauge("tasks_pending", len(todo))
+        total_hits, total_misses = 0, 0
+        for task_id, n_rows, task_time, hits, misses in pool.imap_unordered(
+            functools.partial(classify_task, parts_dir=parts_dir), todo
+        ):
+            total_hits, total_misses = total_hits + hits, total_misses + misses
+            metrics.add_time("task", task_time)
+            metrics.gauge("tasks_pending", metrics.gauges["tasks_pending"] - 1)
+            metrics.add_tweets(0, n_rows)
             print(
-                f"Running model on row number {index} now finished - time in min: {(mid_time - model_time)/60}"
+                f"Finished task {task_id} with {n_rows} rows - time in min: {task_time/60}"
             )
+    if cache_path:
+        lookups = total_hits + total_misses
+        hit_rate = total_hits / lookups if lookups else 0.0
+        print(f"Cache statistics: hits={total_hits}, misses={total_misses}, hit_rate={hit_rate}")
+
+    with metrics.stage("merge"):
+        counts = []
+        for task in tasks:
+            with open(count_path(parts_dir, task[0])) as f:
+                counts.append(int(f.read()))
+        n_rows = merge_parts(
+            [part_path(parts_dir, task[0]) for task in tasks],
+            f"{out_filepath}.csv",
+            get_columns(language),
+            counts,
+        )
+    print(f"Merged {len(tasks)} parts with {n_rows} rows into {out_filepath}.csv")
+    metrics.report()
+    metrics.summary()
+    metrics.close()
+
+
+def parity_check(in_filepath: str, language: str, n_tweets: int = 1000) -> dict:
+    """
+    Compares the outputs of the int8 quantized models with the fp32 models on
+    the first n_tweets tweets (on cpu)
+    """
+    setup_device("cpu")
+    posts = list(itertools.islice(ndjson_gen(in_filepath, FIELDS), n_tweets))
+    rows = {}
+    for quantize in [False, True]:
+        nlp = load_nlp(language, quantize)
+        rows[quantize] = [row for row, _ in classify(nlp, posts, language)]
+    report = compare_outputs(rows[False], rows[True], get_columns(language))
+    print(f"int8 compared to fp32 on {len(rows[False])} tweets:")
+    for col, comparison in report.items():
+        print(f"    {col}: {comparison}")
+    return report
 
 
 if __name__ == "__main__":
@@ -195,12 +717,103 @@ if __name__ == "__main__":
         default="da",
         help="Language of the tweets. Either da or en. Default is da.",
     )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        default="csv",
+        choices=list(SINKS),
+        help="Format of the output file. Either csv, parquet or arrow. Default is csv.",
+    )
+    parser.add_argument(
+        "--flush_rows",
+        type=int,
+        required=False,
+        default=100000,
+        help="Number of rows buffered before they are written to the output file. Default is 100000.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume from the checkpoint of a previous run with the same out_filepath.",
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of worker processes. If more than 1, the input is sharded across workers (csv output only). Default is 1.",
+    )
+    parser.add_argument(
+        "--n_threads",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of torch threads per process. Default is torch's default, or the number of cores divided by n_workers when sharded.",
+    )
+    parser.add_argument(
+        "--chunk_mb",
+        type=int,
+        required=False,
+        default=None,
+        help="If defined, input files are split into shards of about this many MB. Default is one shard per file.",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        required=False,
+        default="gpu",
+        choices=["gpu", "cpu"],
+        help="Device to run the models on. Either gpu or cpu. Default is gpu.",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Use dynamic int8 quantization of the models (only with --device cpu).",
+    )
+    parser.add_argument(
+        "--parity_check",
+        type=int,
+        required=False,
+        default=None,
+        help="If defined, compares the int8 models to the fp32 models on this many tweets and exits.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        required=False,
+        default=1024,
+        help="Batch size of the models. Default is 1024.",
+    )
+    parser.add_argument(
+        "--bucket_batches",
+        type=int,
+        required=False,
+        default=16,
+        help="Number of batches in the window within which tweets are batched by length. 1 disables bucketing. Default is 16.",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        required=False,
+        default=None,
+        help="If defined, path of a SQLite file caching the model outputs of cleaned texts, so duplicate tweets skip the models.",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        required=False,
+        default=None,
+        help="If defined, path of a json lines file for throughput metrics (tweets/sec, time per stage, memory).",
+    )
     args = parser.parse_args()
+    if args.quantize and args.device != "cpu":
+        parser.error("--quantize requires --device cpu")
 
     print("Starting time")
     time_start = time.time()
 
-    in_filepath = args.in_filepath + "*.ndjson"
+    in_filepath = args.in_filepath + "*.ndjson*"  # also .ndjson.gz and .ndjson.zst
     out_filepath = args.out_filepath
     language = args.language
 
@@ -208,9 +821,54 @@ if __name__ == "__main__":
         f"""Running tweets_bert.py with:
              in_filepath = {in_filepath},
              out_filepath= {out_filepath},
-             language= {language}"""
+             language= {language},
+             backend= {args.backend},
+             flush_rows= {args.flush_rows},
+             resume= {args.resume},
+             n_workers= {args.n_workers},
+             device= {args.device},
+             quantize= {args.quantize},
+             batch_size= {args.batch_size},
+             bucket_batches= {args.bucket_batches},
+             cache= {args.cache},
+             metrics= {args.metrics}"""
     )
-    main(in_filepath, out_filepath, language)
+    if args.parity_check:
+        parity_check(in_filepath, language, args.parity_check)
+    elif args.n_workers > 1:
+        if args.backend != "csv":
+            raise ValueError("Sharded classification only supports the csv backend")
+        main_sharded(
+            in_filepath,
+            out_filepath,
+            language,
+            n_workers=args.n_workers,
+            n_threads=args.n_threads,
+            chunk_mb=args.chunk_mb,
+            resume=args.resume,
+            device=args.device,
+            quantize=args.quantize,
+            batch_size=args.batch_size,
+            bucket_batches=args.bucket_batches,
+            cache_path=args.cache,
+            metrics_path=args.metrics,
+        )
+    else:
+        main(
+            in_filepath,
+            out_filepath,
+            language,
+            backend=args.backend,
+            flush_rows=args.flush_rows,
+            resume=args.resume,
+            device=args.device,
+            quantize=args.quantize,
+            n_threads=args.n_threads,
+            batch_size=args.batch_size,
+            bucket_batches=args.bucket_batches,
+            cache_path=args.cache,
+            metrics_path=args.metrics,
+        )
 
     time_end = time.time()
     total_time = time_end - time_start
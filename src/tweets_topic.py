@@ -1,44 +1,126 @@
 """
 Topic modelling on tweets using tweetopic
 """
-from glob import glob
-import ndjson, re
-from csv import writer
+import pickle
+import numpy as np
+from result_sink import open_sink, SINKS
+from checkpoint import Checkpoint, restore_output
+from ndjson_reader import ndjson_gen
+from prob_columns import expand_columns
 from tweetopic import DMM, TopicPipeline
 from sklearn.feature_extraction.text import CountVectorizer
-import pandas as pd
 import time
 import argparse
 
+# fields of the posts used for the output
+FIELDS = ["text", "created_at", "id"]
 
-def ndjson_gen(filepath: str, text_field: str = "text"):
-    for in_file in glob(filepath):
-        with open(in_file) as f:
-            reader = ndjson.reader(f)
 
-            for post in reader:
-                if not post:  # remove empty posts
-                    continue
-                if re.search("^RT", post[text_field]):  # remove retweets
-                    continue
-                yield post
-
-
-def text_gen(filepath: str, text_field: str = "text"):
-    for post in ndjson_gen(filepath):
+def text_gen(filepath: str, text_field: str = "text", **kwargs):
+    for post in ndjson_gen(filepath, [text_field], text_field, **kwargs):
         yield post[text_field]
 
 
-def append_list_as_row(file_name, list_of_elem):
-    # Open file in append mode
-    with open(file_name, "a+", newline="") as write_obj:
-        # Create a writer object from csv module
-        csv_writer = writer(write_obj)
-        # Add contents of list as last row in the csv file
-        csv_writer.writerow(list_of_elem)
+def write_topics(
+    in_filepath: str,
+    out_filepath: str,
+    topics,
+    backend: str,
+    flush_rows: int,
+    checkpoint: Checkpoint,
+    state: dict = None,
+):
+    """
+    Writes the topic distributions of the tweets, with a float32 column per topic,
+    saving a checkpoint on every flush. If state is given, writing continues from
+    that checkpoint.
+    """
+    print("------- \nstart writing output \n-------")
+    start_time = time.time()
+    columns = expand_columns(
+        ["", "created_at", "id", "topic_prob"], {"topic_prob": topics.shape[1]}
+    )
+    progress = {"position": None, "index": 0}
+    posts = ndjson_gen(in_filepath, FIELDS)
+    if state:
+        restore_output(state, f"{out_filepath}.csv")
+        progress = {
+            "position": (state["in_file"], state["offset"]),
+            "index": state["index"],
+        }
+        posts = ndjson_gen(
+            in_filepath,
+            FIELDS,
+            start_file=state["in_file"],
+            start_offset=state["offset"],
+        )
+
+    def commit(sink):
+        position, index = sink.progress
+        checkpoint.commit(position, index, sink.filepath)
+
+    with open_sink(
+        out_filepath,
+        columns,
+        backend=backend,
+        max_rows=flush_rows,
+        append=state is not None,
+        on_flush=commit,
+    ) as sink:
+        for index, (post, topic) in enumerate(
+            zip(posts, topics), start=progress["index"]
+        ):
+            topic = np.asarray(topic, dtype=np.float32)
+            sink.write(
+                [index, post["created_at"], post["id"], *topic],
+                progress=(post["_position"], index + 1),
+            )
+            mid_time = time.time()
+            if index % 10000 == 0:
+                print(
+                    f"row number {index} now finished - time in min: {(mid_time - start_time)/60}"
+                )
+    if sink.progress:
+        progress["position"], progress["index"] = sink.progress
+    if progress["position"]:
+        checkpoint.commit(
+            progress["position"], progress["index"], sink.filepath, finished=True
+        )
+    print("Done with all tweets")
 
 
-def main(in_filepath: str, out_filepath: str, n_topics: int, language: str):
+def main(
+    in_filepath: str,
+    out_filepath: str,
+    n_topics: int,
+    language: str,
+    backend: str = "csv",
+    flush_rows: int = 100000,
+    resume: bool = False,
+):
+    checkpoint = Checkpoint(f"{out_filepath}.checkpoint.json")
+    pipeline_path = f"{out_filepath}.pipeline.pkl"
+    state = checkpoint.load() if resume else None
+    if resume and backend != "csv":
+        raise ValueError("Resuming is only supported for the csv backend")
+    if state and state["finished"]:
+        print(f"All tweets are already written according to {checkpoint.filepath}")
+        return
+    if state:
+        resume_from = {"start_file": state["in_file"], "start_offset": state["offset"]}
+        print(
+            f"Resuming from {state['in_file']} at byte {state['offset']} (row {state['index']})"
+        )
+        with open(pipeline_path, "rb") as f:
+            pipeline = pickle.load(f)
+        start_time = time.time()
+        topics = pipeline.transform(text_gen(in_filepath, **resume_from))
+        print(f"time predicting topics in min: {(time.time() - start_time)/60}")
+        write_topics(
+            in_filepath, out_filepath, topics, backend, flush_rows, checkpoint, state
+        )
+        return
+
     if language == "da":
         file = open("src/stop_words.txt", "r+")
         stop_words = file.read().split()
@@ -65,21 +147,10 @@ def main(in_filepath: str, out_filepath: str, n_topics: int, language: str):
     print(f"Number of tweets = {len(topics)}")
     print(f"Top 3 words in topics: \n {pipeline.top_words(top_n=3)}")
     print(f"time fitting model in min: {(time.time() - start_time)/60}")
+    with open(pipeline_path, "wb") as f:
+        pickle.dump(pipeline, f)
 
-    # write csv
-    print("------- \nstart writing csv \n-------")
-    start_time = time.time()
-    out = pd.DataFrame(columns=["created_at", "id", "topic_prob"])
-    out.to_csv(f"{out_filepath}.csv")
-    for index, (post, topic) in enumerate(zip(ndjson_gen(in_filepath), topics)):
-        row = [index, post["created_at"], post["id"], topic]
-        append_list_as_row(f"{out_filepath}.csv", row)
-        mid_time = time.time()
-        if index % 10000 == 0:
-            print(
-                f"row number {index} now finished - time in min: {(mid_time - start_time)/60}"
-            )
-    print("Done with all tweets")
+    write_topics(in_filepath, out_filepath, topics, backend, flush_rows, checkpoint)
 
 
 if __name__ == "__main__":
@@ -103,12 +174,32 @@ if __name__ == "__main__":
         default="da",
         help="Language of the tweets. Either da or en. Default is da.",
     )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        default="csv",
+        choices=list(SINKS),
+        help="Format of the output file. Either csv, parquet or arrow. Default is csv.",
+    )
+    parser.add_argument(
+        "--flush_rows",
+        type=int,
+        required=False,
+        default=100000,
+        help="Number of rows buffered before they are written to the output file. Default is 100000.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume writing from the checkpoint of a previous run with the same out_filepath.",
+    )
     args = parser.parse_args()
 
     print("Starting time")
     time_start = time.time()
 
-    in_filepath = args.in_filepath + "*.ndjson"
+    in_filepath = args.in_filepath + "*.ndjson*"  # also .ndjson.gz and .ndjson.zst
     out_filepath = args.out_filepath
     n_topics = args.n_topics
     language = args.language
@@ -118,7 +209,18 @@ if __name__ == "__main__":
              in_filepath = {in_filepath},
              out_filepath= {out_filepath},
              n_topics= {n_topics},
-             language= {language}"""
+             language= {language},
+             backend= {args.backend},
+             flush_rows= {args.flush_rows},
+             resume= {args.resume}"""
     )
 
-    main(in_filepath, out_filepath, n_topics, language)
+    main(
+        in_filepath,
+        out_filepath,
+        n_topics,
+        language,
+        args.backend,
+        args.flush_rows,
+        args.resume,
+    )
@@ -0,0 +1,65 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from emotionFluxus import get_time
+from group_stats import (
+    STRFTIME_LEVELS,
+    GroupMoments,
+    get_rollup,
+    group_codes,
+    hist_quantiles,
+)
+
+
+def test_group_codes_skip_missing_keys():
+    df = pd.DataFrame(
+        {
+            "date": ["2020-01-01", None, "2020-01-02", "2020-01-01", "2020-01-02"],
+            "hour": [1, 2, np.nan, 1, 3],
+        }
+    )
+    codes, keys = group_codes(df, ["date", "hour"])
+    assert list(codes) == [0, -1, -1, 0, 1]
+    assert keys == [("2020-01-01", 1.0), ("2020-01-02", 3.0)]
+
+    codes, keys = group_codes(df.iloc[[1, 2]], ["date", "hour"])
+    assert list(codes) == [-1, -1]
+    assert keys == []
+
+
+def test_moments_match_groupby_with_missing_keys():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "date": rng.choice(["2020-01-01", "2020-01-02", None], size=200),
+            "hour": rng.choice([0, 1, np.nan], size=200),
+        }
+    )
+    probs = rng.dirichlet(np.ones(3), size=200)
+    moments = GroupMoments(["date", "hour"])
+    moments.update(df, probs)
+
+    expected = pd.DataFrame(probs).groupby([df["date"], df["hour"]]).mean()
+    records = moments.records()
+    assert [tuple(r["group"]) for r in records] == list(expected.index)
+    np.testing.assert_allclose([r["emo_prob"] for r in records], expected.to_numpy())
+
+
+def test_strftime_levels_readable_by_get_time():
+    key = ("2020-03-15", "13")
+    for level in STRFTIME_LEVELS:
+        (group,) = get_rollup(level)(key)
+        assert get_time({"group": group}).year == 2020
+    assert get_time({"group": "2020-03"}) == datetime.datetime(2020, 3, 1)
+    with pytest.raises(ValueError):
+        get_rollup("%a")
+
+
+def test_hist_quantiles():
+    hists = np.array([[0, 4, 0, 0], [0, 0, 0, 0]])
+    quantiles = hist_quantiles(hists, [0.25, 0.5])
+    np.testing.assert_allclose(quantiles[:, 0], [0.3125, 0.375])
+    assert np.isnan(quantiles[:, 1]).all()
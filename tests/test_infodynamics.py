@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from infodynamics import (
+    OnlineInfoDynamics,
+    novelty_transience_resonance,
+    resample_distributions,
+    sweep_windows,
+)
+
+SIGNALS = ["novelty", "transience", "resonance", "nsigma", "tsigma", "rsigma"]
+
+
+def reference_kld(p, q):
+    with np.errstate(all="ignore"):
+        return np.sum(np.where(p != 0, (p - q) * np.log10(p / q), 0))
+
+
+def reference(data, window):
+    """
+    loop implementation of InfoDynamics of newsFluxus (novelty, transience and
+    resonance with weight 0)
+    """
+    m = data.shape[0]
+    signals = {name: np.zeros(m) for name in SIGNALS}
+    for i, x in enumerate(data):
+        for name, sigma, submat in [
+            ("novelty", "nsigma", data[(i - window) : i]),
+            ("transience", "tsigma", data[i + 1 : i + window + 1]),
+        ]:
+            if submat.any():
+                div = np.array([reference_kld(x, xx) for xx in submat])
+            else:
+                div = np.zeros(window)
+            with np.errstate(invalid="ignore"):  # inf where a distribution has zeros
+                signals[name][i] = np.mean(div)
+                signals[sigma][i] = np.std(div)
+    signals["transience"][-window:] = 0
+    with np.errstate(invalid="ignore"):
+        signals["resonance"] = signals["novelty"] - signals["transience"]
+    signals["rsigma"] = (signals["nsigma"] + signals["tsigma"]) / 2
+    for name in ["resonance", "rsigma"]:
+        signals[name][:window] = 0
+        signals[name][-window:] = 0
+    return signals
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    data = rng.dirichlet(np.ones(5), size=40)
+    data[20:24] = 0  # time points without tweets
+    return data
+
+
+def assert_signals(signals, expected):
+    for name in SIGNALS:
+        np.testing.assert_allclose(signals[name], expected[name], rtol=1e-12)
+
+
+@pytest.mark.parametrize("window", [1, 3, 5])
+def test_matches_reference(data, window):
+    assert_signals(novelty_transience_resonance(data, window), reference(data, window))
+
+
+def test_sweep_windows_matches_reference(data):
+    swept = sweep_windows(data, [5, 2, 3])
+    assert sorted(swept) == [2, 3, 5]
+    for window, signals in swept.items():
+        assert_signals(signals, reference(data, window))
+
+
+@pytest.mark.parametrize("window", [1, 3])
+def test_online_matches_reference(data, window):
+    online = OnlineInfoDynamics(window)
+    done = []
+    for t, distribution in enumerate(data):
+        new, record = online.update(distribution, time=t)
+        assert new["index"] == t
+        if record is not None:
+            done.append(record)
+    done += online.finish()
+
+    assert [record["index"] for record in done] == list(range(len(data)))
+    assert [record["date"] for record in done] == list(range(len(data)))
+    signals = {name: np.array([record[name] for record in done]) for name in SIGNALS}
+    assert_signals(signals, reference(data, window))
+
+
+def test_resample_without_observations():
+    mean = np.array([[0.2, 0.8], [0.0, 0.0], [0.5, 0.5]])
+    sd = np.array([[0.1, 0.1], [0.0, 0.0], [0.2, 0.2]])
+    draws = resample_distributions(
+        mean, sd, [10, 0, 0], n_replicates=4, rng=np.random.default_rng(0)
+    )
+    assert not np.isnan(draws).any()
+    np.testing.assert_array_equal(draws[:, 1], 0)
+    np.testing.assert_array_equal(draws[:, 2], 0.5)
+    np.testing.assert_allclose(draws[:, 0].sum(axis=-1), 1)
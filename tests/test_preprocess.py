@@ -0,0 +1,11 @@
+from preprocess import clean_tweets_batch
+
+
+def test_only_empty_tweets_are_flagged():
+    # mention and url only tweets clean to whitespace, which (as in the
+    # baseline, where spacy gives it a token) is still classified
+    tweets = ["@user ", "@a @b", "", "hej", "RT @x: y", "https://t.co/abc"]
+    cleaned, is_retweet, is_empty = clean_tweets_batch(tweets)
+    assert cleaned == [" ", " ", "", "hej", None, ""]
+    assert is_retweet == [False, False, False, False, True, False]
+    assert is_empty == [False, False, True, False, False, True]
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from smoothing import adaptive_filter, detrend, normalize
+
+
+def reference_detrend(y, seg_len, fit_order=1):
+    """
+    point by point implementation of the adaptive detrending of Gao et al.:
+    each point is the fit of the first segment covering it, blended with
+    weights (t - start) / (overlap - 1) into the fits of the next segments
+    covering it
+    """
+    n_points = len(y)
+    step = (seg_len - 1) // 2
+    starts = list(range(0, n_points - seg_len + 1, step))
+    if starts[-1] + seg_len < n_points:
+        starts.append(n_points - seg_len)
+    x = np.arange(seg_len)
+    fits = [np.polyval(np.polyfit(x, y[s : s + seg_len], fit_order), x) for s in starts]
+
+    trend = np.zeros(n_points)
+    for t in range(n_points):
+        covering = [j for j, s in enumerate(starts) if s <= t < s + seg_len]
+        value = fits[covering[0]][t - starts[covering[0]]]
+        for prev, j in zip(covering, covering[1:]):
+            overlap = starts[prev] + seg_len - starts[j]
+            weight = (t - starts[j]) / (overlap - 1)
+            value = (1 - weight) * value + weight * fits[j][t - starts[j]]
+        trend[t] = value
+    return trend
+
+
+@pytest.mark.parametrize("n_points", [57, 100, 113, 250])
+@pytest.mark.parametrize("seg_len", [5, 9, 21])
+def test_detrend_matches_reference(n_points, seg_len):
+    y = np.cumsum(np.random.default_rng(n_points).standard_normal(n_points))
+    np.testing.assert_allclose(
+        detrend(y, seg_len), reference_detrend(y, seg_len), rtol=1e-9, atol=1e-12
+    )
+
+
+def test_adaptive_filter_keeps_lines():
+    y = 3 * np.arange(200) + 2
+    np.testing.assert_allclose(adaptive_filter(y, span=20), normalize(y), atol=1e-12)
+
+
+def test_constant_signal():
+    np.testing.assert_array_equal(normalize(np.full(10, 0.4)), np.zeros(10))
+    np.testing.assert_array_equal(adaptive_filter(np.full(120, 0.4), 10), np.zeros(120))
@@ -0,0 +1,128 @@
+import os
+
+import ndjson
+import numpy as np
+import pandas as pd
+import pytest
+
+from prob_columns import read_prob_matrix
+import summarize_models
+from summarize_models import read_in_csv
+
+
+def write_legacy_csv(path, n_rows=50):
+    """
+    writes a classification csv in the old format, with the distributions
+    stored as strings of numpy arrays (which wrap over several lines)
+    """
+    rng = np.random.default_rng(0)
+    probs = rng.dirichlet(np.ones(8), size=n_rows).astype(np.float32)
+    times = pd.date_range("2020-01-01", periods=n_rows, freq="h")
+    laden = np.where(np.arange(n_rows) % 3, "Emotional", "No emotion")
+    df = pd.DataFrame(
+        {
+            "created_at": times.astype(str),
+            "Bert_emo_laden": laden,
+            "Bert_emo_emotion_prob": [str(p) for p in probs],
+        }
+    )
+    df.to_csv(path)
+    return df, probs
+
+
+@pytest.mark.parametrize("engine", ["c", "pyarrow"])
+def test_read_legacy_prob_strings(tmp_path, engine):
+    if engine == "pyarrow":
+        pytest.importorskip("pyarrow")
+    path = tmp_path / "legacy.csv"
+    df, probs = write_legacy_csv(path)
+    assert any("\n" in value for value in df["Bert_emo_emotion_prob"])
+
+    out = read_in_csv(
+        str(path), "created_at", "Bert_emo_emotion_prob", only_emo=True, engine=engine
+    )
+    emotional = (df["Bert_emo_laden"] == "Emotional").to_numpy()
+    # numpy prints the array elements with 8 decimals
+    np.testing.assert_allclose(
+        read_prob_matrix(out, "Bert_emo_emotion_prob"), probs[emotional], atol=5e-9
+    )
+    assert list(out["date"]) == list(df["created_at"].str[:10][emotional])
+
+
+def write_pol_csv(path, start, n_rows=40):
+    rng = np.random.default_rng(start)
+    probs = rng.dirichlet(np.ones(3), size=n_rows)
+    times = pd.date_range(f"2020-01-{start:02d}", periods=n_rows, freq="37min")
+    df = pd.DataFrame({"created_at": times.astype(str), "Bert_emo_laden": "Emotional"})
+    for i in range(3):
+        df[f"pol_{i}"] = probs[:, i]
+    df.to_csv(path)
+
+
+def summarize(pattern, output_name, update, quantile_bins=10):
+    summarize_models.main(
+        pattern,
+        output_name,
+        "pol",
+        "created_at",
+        only_emo=False,
+        update=update,
+        quantile_bins=quantile_bins,
+    )
+
+
+def read_summary(output_name, level):
+    path = os.path.join("summarized_emo", f"{output_name}_{level}.ndjson")
+    with open(path) as f:
+        return f.read()
+
+
+def assert_same_summary(records, expected):
+    assert [r["group"] for r in records] == [r["group"] for r in expected]
+    for record, other in zip(records, expected):
+        assert record["n"] == other["n"]
+        assert record["emo_prob_hist"] == other["emo_prob_hist"]
+        for key in ("emo_prob", "emo_prob_sd"):
+            np.testing.assert_allclose(record[key], other[key], rtol=1e-12)
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("summarized_emo")
+    for start in (1, 2, 3):
+        write_pol_csv(tmp_path / f"s{start}.csv", start)
+    return tmp_path
+
+
+def test_update_without_quantile_bins_raises(shards):
+    summarize("s1.csv", "out", update=False)
+    before = read_summary("out", "date")
+    with pytest.raises(ValueError, match="10 bins"):
+        summarize("s[23].csv", "out", update=True, quantile_bins=None)
+    assert read_summary("out", "date") == before
+
+
+def test_update_resumes_after_failed_level(shards, monkeypatch):
+    summarize("s*.csv", "full", update=False)
+
+    summarize("s1.csv", "out", update=False)
+    update_summary = summarize_models.update_summary
+
+    def fail_on_date(moments, filename):
+        if filename.endswith("_date"):
+            raise OSError("disk full")
+        update_summary(moments, filename)
+
+    monkeypatch.setattr(summarize_models, "update_summary", fail_on_date)
+    with pytest.raises(OSError):
+        summarize("s[23].csv", "out", update=True)
+    monkeypatch.setattr(summarize_models, "update_summary", update_summary)
+    summarize("s[23].csv", "out", update=True)
+
+    for level in ("date_hour", "date"):
+        # merged statistics only differ from the one-pass ones by rounding
+        assert_same_summary(
+            ndjson.loads(read_summary("out", level)),
+            ndjson.loads(read_summary("full", level)),
+        )